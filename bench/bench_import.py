@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure the throughput of importing a large mbox file into the mail store"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import mockmail  # NOQA
+
+_MESSAGE = '''From: sender@example.com
+To: Recipient <rcpt%d@example.com>
+Subject: Test message %d
+Content-Type: text/plain; charset=UTF-8
+
+Hello world,
+this is message number %d. See http://example.com/%d for details.
+'''
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    fd, mboxFn = tempfile.mkstemp(suffix='.mbox')
+    try:
+        with os.fdopen(fd, 'wb') as mboxf:
+            for i in range(count):
+                mboxf.write(b'From sender@example.com Thu Jan  1 00:00:00 1970\n')
+                mboxf.write((_MESSAGE % (i, i, i, i)).encode('utf-8'))
+                mboxf.write(b'\n')
+        size = os.path.getsize(mboxFn)
+
+        ms = mockmail.MailStore()
+        start = time.time()
+        with open(mboxFn, 'rb') as mboxf:
+            imported = mockmail.importMbox(ms, mboxf)
+        duration = time.time() - start
+    finally:
+        os.unlink(mboxFn)
+
+    assert imported == count
+    print('Imported %d messages (%.1f MB) in %.2f s: %d messages/s, %.1f MB/s' % (
+        imported, size / 1e6, duration, imported / duration, size / 1e6 / duration))
+
+
+if __name__ == '__main__':
+    main()
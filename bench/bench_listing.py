@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure the time and payload size of one page of the JSON mail listing as the mailbox grows"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import mockmail  # NOQA
+
+_MAIL = '''From: sender@example.com
+To: Philipp Hagemeister <otherto@phihag.de>
+Subject: Registration attempt
+
+Hello world
+'''
+
+
+def _listingPage(mb, **kwargs):
+    first, last, mails = mb.listing(**kwargs)
+    rows = [[
+        m['seq'], m['id'], mockmail._formatTimestamp(m['receivedAt_epoch']),
+        m['from'], m['simple_to'], m['subject']] for m in mails]
+    return json.dumps({'first': first, 'last': last, 'rows': rows}, separators=(',', ':')).encode('utf-8')
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    template = mockmail.parseMail(('127.0.0.1', 4242), 'from@example.com', ['to@example.com'], _MAIL)
+
+    print('%8s %14s %14s %10s' % ('mails', 'newest page', 'middle page', 'bytes'))
+    for size in (1000, 10000, 100000):
+        mb = mockmail.Mailbox('bench')
+        mails = []
+        for i in range(size):
+            mail = template.copy()
+            mail['id'] = mockmail.compat_str(i)
+            mails.append(mail)
+        mb.addMany(mails)
+
+        newest = min(timeit.repeat(lambda: _listingPage(mb), number=number, repeat=5)) / number
+        middle = min(timeit.repeat(lambda: _listingPage(mb, until=size // 2), number=number, repeat=5)) / number
+        print('%8d %11.1f us %11.1f us %10d' % (size, newest * 1e6, middle * 1e6, len(_listingPage(mb))))
+
+
+if __name__ == '__main__':
+    main()
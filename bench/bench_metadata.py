@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure the per-message cost of the receive timestamp and header decoding, and of parsing a small message"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import mockmail  # NOQA
+
+_SUBJECT = '=?utf-8?q?Registrierungsversuch_fehlgeschlagen_=28phihag=40phihag=2Ede=29?='
+_MAIL = '''From: sender@example.com
+To: Philipp Hagemeister <otherto@phihag.de>
+Subject: %s
+Content-Type: text/plain; charset=UTF-8
+
+Hello world
+''' % _SUBJECT
+
+
+def _report(name, stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print('%-26s %8.2f us' % (name, best / number * 1e6))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    _report('receive timestamp', mockmail._receivedAtNow, number)
+    _report('format timestamp (cached)', lambda: mockmail._formatTimestamp(1500000000), number)
+    _report('decode header (uncached)', lambda: mockmail._decodeMailHeaderUncached(_SUBJECT), number)
+    _report('decode header (cached)', lambda: mockmail._decodeMailHeader(_SUBJECT), number)
+    _report('parseMail', lambda: mockmail.parseMail(('127.0.0.1', 4242), 'from@example.com', ['to@example.com'], _MAIL), number // 10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure the time from process start until mockmail accepts the first SMTP connection"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+import py_compile
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+_BASEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+_MOCKMAIL = os.path.join(_BASEDIR, 'bin', 'mockmail.py')
+_TARGET_MS = 100
+
+
+def _freePort():
+    s = socket.socket()
+    try:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+def measure(extraConfig={}):
+    """ @returns The number of seconds until the SMTP greeting arrives """
+    config = {
+        'smtpaddr': '127.0.0.1',
+        'smtpport': _freePort(),
+        'httpaddr': '127.0.0.1',
+        'httpport': _freePort(),
+    }
+    config.update(extraConfig)
+    fd, configFn = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as configf:
+        json.dump(config, configf)
+
+    try:
+        start = time.time()
+        proc = subprocess.Popen([sys.executable, '-W', 'ignore', _MOCKMAIL, '-c', configFn])
+        try:
+            while True:
+                try:
+                    conn = socket.create_connection(('127.0.0.1', config['smtpport']))
+                except socket.error:
+                    time.sleep(0.001)
+                    continue
+                try:
+                    conn.recv(1024)
+                finally:
+                    conn.close()
+                return time.time() - start
+        finally:
+            proc.kill()
+            proc.wait()
+    finally:
+        os.unlink(configFn)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    # Like make install, so that the bytecode is cached even with PYTHONDONTWRITEBYTECODE
+    py_compile.compile(os.path.join(_BASEDIR, 'lib', 'mockmail.py'), doraise=True)
+    times = sorted(measure() for _ in range(runs))
+    median_ms = times[len(times) // 2] * 1000
+    print('Startup until first accepted SMTP connection: median %.1f ms, min %.1f ms, max %.1f ms (%d runs)' % (
+        median_ms, times[0] * 1000, times[-1] * 1000, runs))
+    if median_ms > _TARGET_MS:
+        print('Slower than the target of %d ms' % _TARGET_MS)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1761 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""A test MTA for debugging purposes"""
+
+from __future__ import unicode_literals
+
+__author__ = "Philipp Hagemeister"
+__license__ = "GPL"
+__version__ = "1.10"
+__maintainer__ = "Philipp Hagemeister"
+__status__ = "Production"
+__email__ = "phihag@phihag.de"
+
+import asyncore
+import binascii
+import collections
+import grp
+import json
+import os
+import pwd
+import re
+import signal
+import smtpd
+import socket
+import sys
+import threading
+import time
+import zlib
+
+from optparse import OptionParser
+
+try:
+    from html import escape as html_escape
+except ImportError:  # Python < 3.2
+    import cgi
+
+    def html_escape(v):
+        return cgi.escape(v, quote=True).replace("'", '&#x27;')
+
+try:
+    from urllib.parse import quote as url_quote, unquote as url_unquote, parse_qs
+except ImportError:  # Python 2.x
+    from urllib import quote as url_quote, unquote as url_unquote
+    from urlparse import parse_qs
+
+try:
+    compat_str = unicode  # Python2
+except NameError:
+    compat_str = str  # Python 3
+
+
+_TEMPLATES = ('header', 'footer', 'index', 'mail', 'mailboxes',)
+_STATIC_FILES = ('mockmail.css', 'jquery-1.7.1.min.js', 'mockmail.js', )
+_CHUNK_SIZE = 64 * 1024
+_BUNDLE_FILE = 'mockmail.bundle'
+_CONTENT_TYPES = {
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+}
+# Imported on first use to speed up startup. They must be loaded before entering a chroot.
+_DEFERRED_MODULES = ('email.header', 'email.parser', 'email.utils', 'io', 'mimetypes', 'tarfile', 'tempfile', 'traceback')
+
+
+def _readfile(fn):
+    with open(fn, 'rb') as f:
+        return f.read()
+
+
+class _OnDemandIdReader(object):
+    def __init__(self, ids, fnCalc, mapContent):
+        self._ids = ids
+        self._fnCalc = fnCalc
+        self._mapContent = mapContent
+
+    def __getitem__(self, key):
+        if key not in self._ids:
+            raise KeyError()
+        res = _readfile(self._fnCalc(key))
+        if self._mapContent:
+            res = self._mapContent(res)
+        return res
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, item):
+        return item in self._ids
+
+
+def _readIds(ids, fnCalc, mapContent=None, ondemand=False):
+    """ Read all the files calculated by map(fnCalc, ids), and return a dictionary {id: mapContent(file content)}
+    @param ondemand If this is set, do not actually return a dictionary, but a mock object that reads the contents everytime it is accessed.
+    """
+    if ondemand:
+        return _OnDemandIdReader(ids, fnCalc, mapContent)
+    else:
+        if mapContent is None:
+            mapContent = lambda x: x  # NOQA
+        return dict((fid, mapContent(_readfile(fnCalc(fid)))) for fid in ids)
+
+
+def _templateFn(resourcedir, fid):
+    return os.path.join(resourcedir, 'templates', fid + '.mustache')
+
+
+def _staticFn(resourcedir, fid):
+    return os.path.join(resourcedir, 'static', fid)
+
+
+def _readResources(resourcedir, ondemand=False):
+    """ @returns A tuple (templates, static files) read from the individual files in resourcedir """
+    templates = _readIds(
+        _TEMPLATES,
+        lambda fid: _templateFn(resourcedir, fid),
+        mapContent=lambda content: _parseTemplate(content.decode('UTF-8')),
+        ondemand=ondemand)
+    static = _readIds(
+        _STATIC_FILES,
+        lambda fid: _staticFn(resourcedir, fid),
+        ondemand=ondemand)
+    return templates, static
+
+
+def _gzip(content):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+
+def _buildBundle(resourcedir):
+    """ Write all resources into a single file, with the templates pre-parsed and the static files precompressed """
+    templates, static = _readResources(resourcedir)
+    bundle = {
+        'templates': templates,
+        'static': dict((fid, {
+            'data': binascii.b2a_base64(content).decode('ascii'),
+            'gzip': binascii.b2a_base64(_gzip(content)).decode('ascii'),
+        }) for fid, content in static.items()),
+    }
+    bundleFn = os.path.join(resourcedir, _BUNDLE_FILE)
+    with open(bundleFn + '.tmp', 'w') as bundlef:
+        json.dump(bundle, bundlef)
+    os.rename(bundleFn + '.tmp', bundleFn)
+    return bundleFn
+
+
+def _loadBundle(resourcedir):
+    """ @returns A tuple (templates, static files, gzipped static files), or None if there is no up-to-date bundle """
+    bundleFn = os.path.join(resourcedir, _BUNDLE_FILE)
+    try:
+        bundleMtime = os.stat(bundleFn).st_mtime
+    except OSError:
+        return None
+    sourceFns = (
+        [_templateFn(resourcedir, fid) for fid in _TEMPLATES] +
+        [_staticFn(resourcedir, fid) for fid in _STATIC_FILES])
+    for fn in sourceFns:
+        try:
+            if os.stat(fn).st_mtime > bundleMtime:
+                return None
+        except OSError:
+            pass  # Only the bundle has been installed
+
+    bundle = json.loads(_readfile(bundleFn).decode('UTF-8'))
+    if set(bundle['templates']) != set(_TEMPLATES) or set(bundle['static']) != set(_STATIC_FILES):
+        return None
+    static = dict((fid, binascii.a2b_base64(v['data'])) for fid, v in bundle['static'].items())
+    staticGzip = dict((fid, binascii.a2b_base64(v['gzip'])) for fid, v in bundle['static'].items())
+    return bundle['templates'], static, staticGzip
+
+
+def _loadResources(resourcedir, ondemand=False):
+    """ @returns A tuple (templates, static files, gzipped static files). The prebuilt bundle is used if available. """
+    if not ondemand:
+        bundle = _loadBundle(resourcedir)
+        if bundle is not None:
+            return bundle
+    templates, static = _readResources(resourcedir, ondemand)
+    return templates, static, {}
+
+
+def _contentType(fn):
+    ext = os.path.splitext(fn)[1]
+    if ext in _CONTENT_TYPES:
+        return _CONTENT_TYPES[ext]
+    import mimetypes
+    return mimetypes.guess_type(fn)[0]
+
+
+def _acceptsGzip(acceptEncoding):
+    for coding in (acceptEncoding or '').split(','):
+        parts = coding.split(';')
+        if parts[0].strip().lower() != 'gzip':
+            continue
+        for param in parts[1:]:
+            k, _, v = param.partition('=')
+            if k.strip() == 'q':
+                try:
+                    return float(v) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+class _MemoCache(object):
+    """ Memoize a function of one hashable argument, keeping at most maxsize results """
+    def __init__(self, func, maxsize):
+        self._func = func
+        self._maxsize = maxsize
+        self._cache = {}
+
+    def __call__(self, arg):
+        try:
+            return self._cache[arg]
+        except KeyError:
+            pass
+        res = self._func(arg)
+        if len(self._cache) >= self._maxsize:
+            self._cache.clear()
+        self._cache[arg] = res
+        return res
+
+
+_receivedAtLock = threading.Lock()
+_lastReceivedAt = [0]
+
+
+def _receivedAtNow(now=None):
+    """ @returns The current time (or now) in seconds since the epoch, never less than a previous result even if the clock is turned back """
+    if now is None:
+        now = time.time()
+    now = int(now)
+    _receivedAtLock.acquire()
+    try:
+        if now < _lastReceivedAt[0]:
+            now = _lastReceivedAt[0]
+        _lastReceivedAt[0] = now
+        return now
+    finally:
+        _receivedAtLock.release()
+
+
+# Mails tend to arrive in bursts, so formatting is cached by second
+_formatTimestamp = _MemoCache(
+    lambda ts: compat_str(time.strftime('%Y-%m-%d %H:%M:%S %Z', time.localtime(ts))),
+    maxsize=4096)
+
+
+_TENANT_KEYS = (None, 'domain', 'tag', 'helo')
+_DEFAULT_TENANT = 'default'
+
+
+def _tenantName(tenant_by, mail):
+    """ Determine the name of the mailbox a mail belongs to.
+    @param tenant_by One of _TENANT_KEYS. Mails are partitioned by the first recipient's domain, its plus-address tag, or the HELO name.
+    """
+    rcpt = mail['rcpttos'][0] if mail['rcpttos'] else ''
+    if tenant_by == 'domain':
+        name = rcpt.rpartition('@')[2]
+    elif tenant_by == 'tag':
+        name = rcpt.rpartition('@')[0].partition('+')[2]
+    elif tenant_by == 'helo':
+        name = mail['helo'] or ''
+    else:
+        name = ''
+    name = name.strip('<> ').lower()
+    return name or _DEFAULT_TENANT
+
+
+def _discardMail(mail):
+    spooled = [mail.get('rawfile')] + [part.get('file') for part in mail.get('bodies', [])]
+    for fn in spooled:
+        if fn:
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
+
+
+class Mailbox(object):
+    """ Threadsafe storage of the mails of one tenant. The oldest mails are evicted once a quota is exceeded.
+    Every mail gets a sequence number (mail['seq']) in order of arrival, by which the mails can be listed in constant time per mail.
+    """
+    def __init__(self, name, max_mails=None, max_bytes=None):
+        self.name = name
+        self._max_mails = max_mails
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._slots = []  # Mails by sequence number - _baseSeq, None for deleted ones
+        self._head = 0  # Index of the oldest slot still in use
+        self._baseSeq = 0
+        self._byId = {}
+        self._bytes = 0
+
+    def _overQuota(self):
+        return (
+            (self._max_mails is not None and len(self._byId) > self._max_mails) or
+            (self._max_bytes is not None and self._bytes > self._max_bytes))
+
+    def _remove(self, mail):
+        self._slots[mail['seq'] - self._baseSeq] = None
+        del self._byId[mail['id']]
+        self._bytes -= mail['size']
+
+    def _compact(self):
+        while self._head < len(self._slots) and self._slots[self._head] is None:
+            self._head += 1
+        if self._head > 1024 and self._head * 2 > len(self._slots):
+            del self._slots[:self._head]
+            self._baseSeq += self._head
+            self._head = 0
+
+    def add(self, mail):
+        self.addMany([mail])
+
+    def addMany(self, mails):
+        evicted = []
+        self._lock.acquire()
+        try:
+            for mail in mails:
+                mail['seq'] = self._baseSeq + len(self._slots)
+                self._slots.append(mail)
+                self._byId[mail['id']] = mail
+                self._bytes += mail['size']
+            while self._byId and self._overQuota():
+                old = self._slots[self._head]
+                self._remove(old)
+                self._compact()
+                evicted.append(old)
+        finally:
+            self._lock.release()
+        for old in evicted:
+            _discardMail(old)
+
+    @property
+    def mails(self):
+        self._lock.acquire()
+        try:
+            return [m for m in self._slots[self._head:] if m is not None]
+        finally:
+            self._lock.release()
+
+    def listing(self, until=None, after=None, count=100):
+        """ List mails newest first, in time proportional to count (not the number of mails).
+        @param until Only list mails with a sequence number up to this one
+        @param after Only list mails with a sequence number greater than this one
+        @returns A tuple (sequence number of the oldest mail, sequence number of the newest mail, list of mails)
+        """
+        self._lock.acquire()
+        try:
+            first = self._baseSeq + self._head
+            last = self._baseSeq + len(self._slots) - 1
+            top = last if until is None else min(until, last)
+            bottom = first if after is None else max(after + 1, first)
+            bottom = max(bottom, top - count + 1)
+            slots = (self._slots[seq - self._baseSeq] for seq in range(top, bottom - 1, -1))
+            return first, last, [m for m in slots if m is not None]
+        finally:
+            self._lock.release()
+
+    @property
+    def size(self):
+        """ Total size of all mails in bytes """
+        return self._bytes
+
+    def __len__(self):
+        return len(self._byId)
+
+    def get(self, mid):
+        self._lock.acquire()
+        try:
+            return self._byId.get(mid)
+        finally:
+            self._lock.release()
+
+    def delete(self, filterf):
+        """ Only keep the mails for which filterf returns a true value """
+        self._lock.acquire()
+        try:
+            removed = [m for m in self._byId.values() if not filterf(m)]
+            for m in removed:
+                self._remove(m)
+            self._compact()
+        finally:
+            self._lock.release()
+        for m in removed:
+            _discardMail(m)
+
+
+class MailStore(object):
+    """ Threadsafe mail storage class, partitioned into one Mailbox per tenant """
+    def __init__(self, tenant_by=None, max_mails=None, max_bytes=None, tenant_limits=None):
+        """
+        @param tenant_by How to partition mails into mailboxes, see _tenantName
+        @param max_mails, max_bytes Default quota of every mailbox, None for unlimited
+        @param tenant_limits Overrides of the quota by mailbox name, e.g. {"example.com": {"max_mails": 100}}
+        """
+        if tenant_by not in _TENANT_KEYS:
+            raise ValueError('Invalid tenant_by %r, must be one of %r' % (tenant_by, _TENANT_KEYS))
+        self.tenant_by = tenant_by
+        self._max_mails = max_mails
+        self._max_bytes = max_bytes
+        self._tenant_limits = tenant_limits or {}
+        self._lock = threading.Lock()
+        self._mailboxes = {}
+        self._id = 0
+
+    def _getOrCreateMailbox(self, name):
+        mb = self._mailboxes.get(name)
+        if mb is None:
+            limits = self._tenant_limits.get(name, {})
+            mb = Mailbox(
+                name,
+                max_mails=limits.get('max_mails', self._max_mails),
+                max_bytes=limits.get('max_bytes', self._max_bytes))
+            self._mailboxes[name] = mb
+        return mb
+
+    def add(self, mail):
+        self.addMany([mail])
+
+    def addMany(self, mails):
+        """ Add a batch of mails, locking only once per batch and mailbox """
+        names = [_tenantName(self.tenant_by, mail) for mail in mails]
+        batches = collections.OrderedDict()
+        self._lock.acquire()
+        try:
+            for mail, name in zip(mails, names):
+                mail['id'] = compat_str(self._id)
+                self._id += 1
+                mail['mailbox'] = name
+                mb = self._getOrCreateMailbox(name)
+                batches.setdefault(name, (mb, []))[1].append(mail)
+        finally:
+            self._lock.release()
+        for mb, batch in batches.values():
+            mb.addMany(batch)
+
+    @property
+    def mailboxes(self):
+        self._lock.acquire()
+        try:
+            return sorted(self._mailboxes.values(), key=lambda mb: mb.name)
+        finally:
+            self._lock.release()
+
+    def getMailbox(self, name):
+        """
+        Raises a KeyError if there is no such mailbox
+        """
+        self._lock.acquire()
+        try:
+            return self._mailboxes[name]
+        finally:
+            self._lock.release()
+
+    @property
+    def mails(self):
+        return [m for mb in self.mailboxes for m in mb.mails]
+
+    def getById(self, mid):
+        """
+        Raises a KeyError if the id is not found
+        """
+        try:
+            mid = compat_str(int(mid))
+        except ValueError:
+            raise KeyError('Invalid key')
+
+        for mb in self.mailboxes:
+            mail = mb.get(mid)
+            if mail is not None:
+                return mail
+        raise KeyError()
+
+    def delete(self, filterf):
+        """ Only keep the mails for which filterf returns a true value """
+        for mb in self.mailboxes:
+            mb.delete(filterf)
+
+
+def _decodeCharset(blob, enc):
+    """ Decode blob from the charset enc. Unknown charsets (or ones not preloaded into the chroot) fall back to latin-1, so that the mail is still received. """
+    if isinstance(blob, compat_str):  # Python 2.x's email package returns payloads without transfer encoding as they are
+        return blob
+    try:
+        return blob.decode(enc)
+    except LookupError:
+        return blob.decode('latin-1')
+
+
+def _decodeMailHeaderUncached(rawVal):
+    import email.header
+    return ''.join(
+        (v.decode('ascii', 'replace') if isinstance(v, bytes) else v) if enc is None else _decodeCharset(v, enc)
+        for v, enc in email.header.decode_header(rawVal))
+
+
+# Subjects and other headers often repeat across mails
+_decodeMailHeaderCached = _MemoCache(_decodeMailHeaderUncached, maxsize=4096)
+
+
+def _decodeMailHeader(rawVal):
+    if isinstance(rawVal, compat_str):
+        return _decodeMailHeaderCached(rawVal)
+    return _decodeMailHeaderUncached(rawVal)  # email.header.Header objects are not hashable
+
+
+_NON_BASE64_RE = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+def _a2bBase64Lenient(enc):
+    """ Decode base64 as leniently as the email package does; misplaced padding must not prevent receiving a mail """
+    for candidate in (enc, enc + '=='):
+        try:
+            return binascii.a2b_base64(candidate)
+        except binascii.Error:
+            pass
+    return b''  # Undecodable garbage
+
+
+def _iterDecodedPayload(payload, cte, chunkSize=_CHUNK_SIZE):
+    """ Yield the transfer-decoded content of a (non-multipart) payload as byte chunks.
+    The decoded content is never materialized as a whole, so that large attachments can be streamed.
+    @param cte The value of the Content-Transfer-Encoding header, or None
+    """
+    cte = (cte or '7bit').strip().lower()
+    rest = ''
+    if cte == 'base64':
+        for p in range(0, len(payload), chunkSize):
+            enc = rest + _NON_BASE64_RE.sub('', payload[p:p + chunkSize])
+            cut = len(enc) - len(enc) % 4
+            rest = enc[cut:]
+            if cut:
+                yield _a2bBase64Lenient(enc[:cut])
+        if rest:
+            yield _a2bBase64Lenient(rest + '=' * (-len(rest) % 4))
+    elif cte == 'quoted-printable':
+        for p in range(0, len(payload), chunkSize):
+            enc = rest + payload[p:p + chunkSize]
+            cut = enc.rfind('\n') + 1
+            rest = enc[cut:]
+            if cut:
+                yield binascii.a2b_qp(enc[:cut].encode('utf-8'))
+        if rest:
+            yield binascii.a2b_qp(rest.encode('utf-8'))
+    else:
+        for p in range(0, len(payload), chunkSize):
+            yield payload[p:p + chunkSize].encode('utf-8')
+
+
+def _sliceChunks(chunks, start, end):
+    """ Yield only the bytes [start, end) of the stream formed by chunks """
+    pos = 0
+    for chunk in chunks:
+        chunkEnd = pos + len(chunk)
+        if chunkEnd > start:
+            yield chunk[max(start - pos, 0):end - pos]
+        pos = chunkEnd
+        if pos >= end:
+            break
+
+
+def _parseMessage(msg):
+    res = {
+        'payload': msg.get_payload()
+    }
+    if msg.is_multipart():
+        res['html'] = ''
+        return res
+
+    res['content_type'] = msg.get_content_type()
+    res['charset'] = msg.get_content_charset()
+    filename = msg.get_filename()
+    res['filename'] = None if filename is None else _decodeMailHeader(filename)
+    res['transfer_encoding'] = msg['content-transfer-encoding']
+    res['size'] = sum(len(chunk) for chunk in _iterDecodedPayload(res['payload'], res['transfer_encoding']))
+    disposition = (msg['content-disposition'] or '').split(';')[0].strip().lower()
+    inline = (
+        msg.get_content_maintype() == 'text' and
+        disposition != 'attachment' and
+        (disposition == 'inline' or not res['filename']))
+    if inline:
+        enc = msg.get_content_charset()
+        if enc is None:
+            enc = 'ASCII'
+        res['text'] = _decodeCharset(msg.get_payload(None, True), enc)
+
+        html = html_escape(res['text'])
+        html = re.sub('https?://([a-zA-Z.0-9/\-_?;=]|&amp;)+', lambda m: '<a href="' + m.group(0) + '">' + m.group(0) + '</a>', html)
+        res['html'] = html
+        res['attachment'] = False
+    else:
+        res['html'] = html_escape('[attachment: %s]' % (res['filename'] or res['content_type']))
+        res['attachment'] = True
+    return res
+
+
+def _headerRecipients(msg):
+    """ Guess the envelope recipients of a message that did not arrive via SMTP """
+    import email.utils
+    for hname in ('X-Original-To', 'Delivered-To'):
+        if msg.get_all(hname):
+            return [addr for _, addr in email.utils.getaddresses(msg.get_all(hname)) if addr]
+    return [addr for _, addr in email.utils.getaddresses(msg.get_all('To', []) + msg.get_all('Cc', [])) if addr]
+
+
+def parseMail(peer, mailfrom, rcpttos, data, helo=None):
+    """
+    @param rcpttos The envelope recipients, or None to determine them from the headers
+    @param data The message, preferably as the bytes received. These are kept unchanged (in mail['rawdata']).
+    """
+    import email.parser
+    if isinstance(data, bytes):
+        raw = data
+        data = raw.decode('utf8', 'replace')
+    else:
+        raw = data.encode('utf-8')
+    feedParser = email.parser.FeedParser()
+    feedParser.feed(data)
+    msg = feedParser.close()
+    if rcpttos is None:
+        rcpttos = _headerRecipients(msg)
+
+    receivedAt = _receivedAtNow()
+
+    subject = (
+        _decodeMailHeader(msg['subject'])
+        if msg['subject']
+        else '[mockmail: no subject]'
+    )
+
+    envelope = (
+        ('HELO: %s\n' % helo if helo else '') +
+        ('MAIL-FROM: %s\n' % mailfrom) +
+        ('\n'.join('RCPT-TO: %s' % rcpto for rcpto in rcpttos))
+    )
+    simple_to = (
+        (rcpttos[0] if len(rcpttos) > 0 else '<nobody>')
+        if msg['to'] is None
+        else msg['to']
+    )
+    peer_formatted_ip = ('[%s]' % peer[0] if ':' in peer[0] else peer[0])
+    peer_str = '%s:%s' % (peer_formatted_ip, peer[1])
+    bodies = [_parseMessage(submessage) for submessage in msg.walk()]
+
+    res = {
+        'peer_str': peer_str,
+        'peer_ip': peer[0],
+        'peer_port': peer[1],
+        'envelope': envelope,
+        'mailfrom': mailfrom,
+        'rcpttos': rcpttos,
+        'helo': helo,
+        'from': msg['from'] or mailfrom,
+        'simple_to': simple_to,
+        'rawdata': raw,
+        'rawfile': None,
+        'size': len(raw),
+        'subject': subject,
+        'receivedAt_epoch': receivedAt,
+        'bodies': bodies,
+        'attachments': [{
+            'part': compat_str(i),
+            'filename': b['filename'] or ('part-%d' % i),
+            'content_type': b['content_type'],
+            'size': b['size'],
+        } for i, b in enumerate(bodies) if b.get('attachment')],
+    }
+    return res
+
+
+def _spoolMessage(spooldir, raw):
+    """ Write the raw message to a new file in spooldir and return the filename """
+    import tempfile
+    fd, fn = tempfile.mkstemp(suffix='.eml', dir=spooldir)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(raw)
+    return fn
+
+
+def _spoolParts(mail):
+    """ Write the transfer-decoded content of every part next to the spooled raw message (to part['file']), and drop the payloads from memory """
+    for i, part in enumerate(mail['bodies']):
+        if 'size' in part:  # not a multipart container
+            fn = '%s.%d' % (mail['rawfile'], i)
+            with open(fn, 'wb') as f:
+                for chunk in _iterDecodedPayload(part['payload'], part['transfer_encoding']):
+                    f.write(chunk)
+            part['file'] = fn
+        part['payload'] = None
+
+
+def _receiveMessage(peer, mailfrom, rcpttos, raw, helo=None, spooldir=None):
+    """ Parse a message given as raw bytes (and spool it to disk if spooldir is set)
+    @returns The mail, ready to be added to a MailStore
+    """
+    mail = parseMail(peer, mailfrom, rcpttos, raw, helo)
+    if spooldir is not None:
+        mail['rawfile'] = _spoolMessage(spooldir, raw)
+        mail['rawdata'] = None
+        # Only the decoded texts stay in memory; downloaded parts are served from their own files
+        _spoolParts(mail)
+    return mail
+
+
+def _rawMessage(mail):
+    """ @returns The original message as bytes """
+    if mail['rawfile'] is None:
+        return mail['rawdata']
+    return _readfile(mail['rawfile'])
+
+
+_MBOX_SENDER = 'MAILER-DAEMON'
+_MBOX_QUOTE_RE = re.compile(b'^>*From ', re.MULTILINE)
+
+
+def _mboxEntry(mail):
+    """ @returns The mail as an entry of an mboxrd file """
+    fromLine = 'From %s %s\n' % (
+        (mail['mailfrom'] or _MBOX_SENDER).replace(' ', '_'),
+        time.asctime(time.gmtime(mail['receivedAt_epoch'])))
+    raw = _MBOX_QUOTE_RE.sub(b'>\\g<0>', _rawMessage(mail))
+    if not raw.endswith(b'\n'):
+        raw += b'\n'
+    return fromLine.encode('utf-8') + raw + b'\n'
+
+
+def _iterMbox(f):
+    """ Read an mboxrd file without loading it completely.
+    @returns An iterator of tuples (envelope sender, raw message)
+    """
+    sender = None
+    lines = []
+    for line in f:
+        if line.startswith(b'From '):
+            if sender is not None:
+                yield sender, _mboxMessage(lines)
+            fields = line[len(b'From '):].split(None, 1)
+            sender = fields[0].decode('utf-8', 'replace') if fields else _MBOX_SENDER
+            lines = []
+        elif sender is not None:
+            if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                line = line[1:]
+            lines.append(line)
+    if sender is not None:
+        yield sender, _mboxMessage(lines)
+
+
+def _mboxMessage(lines):
+    if lines and lines[-1] in (b'\n', b'\r\n'):  # Separator line
+        lines.pop()
+    return b''.join(lines)
+
+
+def importMbox(ms, f, spooldir=None, batchSize=1000):
+    """ Load all messages of the mboxrd file f into the MailStore ms, bypassing SMTP.
+    Recipients are determined from the headers.
+    @returns The number of imported messages
+    """
+    count = 0
+    batch = []
+    for sender, raw in _iterMbox(f):
+        if sender == _MBOX_SENDER:
+            sender = ''
+        batch.append(_receiveMessage(('import', 0), sender, None, raw, spooldir=spooldir))
+        if len(batch) >= batchSize:
+            ms.addMany(batch)
+            count += len(batch)
+            batch = []
+    ms.addMany(batch)
+    return count + len(batch)
+
+
+def _writeMaildirTar(fileobj, mails):
+    """ Stream the mails as a tar archive of a Maildir (with the subdirectories cur, new and tmp) to fileobj """
+    import io
+    import tarfile
+    tar = tarfile.open(fileobj=fileobj, mode='w|')
+    now = time.time()
+    for d in ('cur', 'new', 'tmp'):
+        info = tarfile.TarInfo(d)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o700
+        info.mtime = now
+        tar.addfile(info)
+    for mail in mails:
+        raw = _rawMessage(mail)
+        info = tarfile.TarInfo('new/%d.M%s.mockmail' % (mail['receivedAt_epoch'], mail['id']))
+        info.size = len(raw)
+        info.mode = 0o600
+        info.mtime = mail['receivedAt_epoch']
+        tar.addfile(info, io.BytesIO(raw))
+    tar.close()
+
+
+_MAILDIR_MEMBER_RE = re.compile(r'^(?:cur|new|tmp)(?:/(?!\.\.?$)[^/]+)?$')
+
+
+def _extractMaildirTar(fileobj, target):
+    """ Extract a tar archive as written by _writeMaildirTar into the directory target.
+    Raises a ValueError (possibly after extracting some files) if the archive contains anything but the Maildir subdirectories and files in them. """
+    import tarfile
+    tar = tarfile.open(fileobj=fileobj, mode='r|')
+    try:
+        for info in tar:
+            if not _MAILDIR_MEMBER_RE.match(info.name) or not (info.isfile() or info.isdir()):
+                raise ValueError('Unexpected entry %r in Maildir archive' % info.name)
+            if hasattr(tarfile, 'data_filter'):
+                tar.extract(info, target, filter='data')
+            else:
+                tar.extract(info, target)
+    finally:
+        tar.close()
+
+
+class _AdmissionControl(object):
+    """ Limits on incoming mail, so that overload results in temporary SMTP failures (which senders retry) instead of unbounded memory use.
+    Only used from the asyncore thread, so there is no locking.
+    """
+    def __init__(self, max_sessions=None, max_pending_bytes=None, peer_rate=None, peer_burst=10):
+        """
+        @param max_sessions Maximum number of concurrent SMTP sessions
+        @param max_pending_bytes Maximum total size of the messages currently being received
+        @param peer_rate Maximum sustained number of messages per second from one IP address
+        @param peer_burst Number of messages an IP address may send in a row before peer_rate applies
+        """
+        self._max_sessions = max_sessions
+        self._max_pending_bytes = max_pending_bytes
+        self._peer_rate = peer_rate
+        self._peer_burst = peer_burst
+        self.sessions = 0
+        self.pendingBytes = 0
+        self.peakPendingBytes = 0
+        self._buckets = {}  # IP address -> (tokens, time of last update)
+
+    def openSession(self):
+        if self._max_sessions is not None and self.sessions >= self._max_sessions:
+            return False
+        self.sessions += 1
+        return True
+
+    def closeSession(self):
+        self.sessions -= 1
+
+    @property
+    def overloaded(self):
+        return self._max_pending_bytes is not None and self.pendingBytes >= self._max_pending_bytes
+
+    def reserveBytes(self, count):
+        if self._max_pending_bytes is not None and self.pendingBytes + count > self._max_pending_bytes:
+            return False
+        self.pendingBytes += count
+        self.peakPendingBytes = max(self.peakPendingBytes, self.pendingBytes)
+        return True
+
+    def releaseBytes(self, count):
+        self.pendingBytes -= count
+
+    def tooBig(self, count):
+        """ @returns Whether a message of count bytes could never be accepted, even without any other pending messages """
+        return self._max_pending_bytes is not None and count > self._max_pending_bytes
+
+    def allowMessage(self, ip, now=None):
+        """ Token bucket rate limiting by IP address """
+        if self._peer_rate is None:
+            return True
+        if now is None:
+            now = time.time()
+        if len(self._buckets) > 10000:
+            self._pruneBuckets(now)
+        tokens, last = self._buckets.get(ip, (self._peer_burst, now))
+        tokens = min(self._peer_burst, tokens + (now - last) * self._peer_rate)
+        if tokens < 1:
+            self._buckets[ip] = (tokens, now)
+            return False
+        self._buckets[ip] = (tokens - 1, now)
+        return True
+
+    def _pruneBuckets(self, now):
+        refill = self._peer_burst / float(self._peer_rate)
+        for ip, (tokens, last) in list(self._buckets.items()):
+            if now - last >= refill:  # bucket is full again
+                del self._buckets[ip]
+
+
+class _MockmailSmtpChannel(smtpd.SMTPChannel):
+    def __init__(self, server, *args, **kwargs):
+        self._pendingBytes = 0
+        self._refusal = None  # Reply to the current message if it is going to be refused
+        self._sessionOpen = True  # The server has counted us already
+        smtpd.SMTPChannel.__init__(self, server, *args, **kwargs)
+
+    def _releasePending(self):
+        self.smtp_server.admission.releaseBytes(self._pendingBytes)
+        self._pendingBytes = 0
+
+    def collect_incoming_data(self, data):
+        if self.smtp_state == self.DATA:
+            if self._refusal:
+                return
+            admission = self.smtp_server.admission
+            if not admission.reserveBytes(len(data)):
+                # Drop what we have so far, the message is going to be refused anyway
+                if admission.tooBig(self._pendingBytes + len(data)):
+                    self._refusal = '552 5.3.4 Message too big for system'
+                else:
+                    self._refusal = '452 4.3.1 Insufficient system storage, try again later'
+                self.received_lines = []
+                self._releasePending()
+                return
+            self._pendingBytes += len(data)
+        smtpd.SMTPChannel.collect_incoming_data(self, data)
+
+    def smtp_MAIL(self, arg):
+        # Rate limit before the peer gets to send a message. Out-of-order commands are left to smtpd to refuse.
+        if self.seen_greeting and self.mailfrom is None and not self.smtp_server.admission.allowMessage(self.addr[0]):
+            self.push('450 4.7.0 Too many messages from %s, try again later' % self.addr[0])
+            return
+        smtpd.SMTPChannel.smtp_MAIL(self, arg)
+
+    def smtp_DATA(self, arg):
+        if self.smtp_server.admission.overloaded:
+            self.push('452 4.3.1 Insufficient system storage, try again later')
+            return
+        smtpd.SMTPChannel.smtp_DATA(self, arg)
+
+    def found_terminator(self):
+        if self.smtp_state != self.DATA:
+            smtpd.SMTPChannel.found_terminator(self)
+            return
+
+        if self._refusal:
+            refusal = self._refusal
+            self._refusal = None
+            self.received_lines = []
+            self.num_bytes = 0
+            self._set_post_data_state()
+            self.push(refusal)
+            return
+        # process_message does not get to see the channel, so tell the server which HELO name the message came with
+        self.smtp_server.current_helo = self.seen_greeting or None
+        try:
+            smtpd.SMTPChannel.found_terminator(self)
+        finally:
+            self._releasePending()
+
+    def close(self):
+        if self._sessionOpen:
+            self._sessionOpen = False
+            self._releasePending()
+            self.smtp_server.admission.closeSession()
+        smtpd.SMTPChannel.close(self)
+
+
+class MockmailSmtpServer(smtpd.SMTPServer):
+    channel_class = _MockmailSmtpChannel  # Ignored (and HELO names, session and pending bytes limits therefore not in effect) in Python 2.x
+
+    def __init__(self, localaddr, port, ms, spooldir=None, admission=None):
+        self._ms = ms
+        self._spooldir = spooldir
+        self.admission = admission or _AdmissionControl()
+        self.current_helo = None
+        # In python 3, '' cannot be given anymore to listen to anything
+        if localaddr == '' and sys.version_info[0] >= 3:
+            localaddr = '::'
+        smtpd.SMTPServer.__init__(self, (localaddr, port), None)
+
+    def handle_accepted(self, conn, addr):
+        if not self.admission.openSession():
+            try:
+                conn.sendall(b'421 4.3.2 Too many connections, try again later\r\n')
+            except socket.error:
+                pass
+            conn.close()
+            return
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    # kwargs for python 3.6 where additional options are present
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        if sys.version_info[0] < 3 and not self.admission.allowMessage(peer[0]):
+            # Python 2.x ignores channel_class, so the rate limit in smtp_MAIL does not apply
+            return '452 4.7.0 Too many messages from %s, try again later' % peer[0]
+        raw = data if isinstance(data, bytes) else data.encode('utf8')
+        try:
+            mail = _receiveMessage(peer, mailfrom, rcpttos, raw, self.current_helo, self._spooldir)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            raise
+        self._ms.add(mail)
+
+
+class _MockmailHttpServer:
+    # Mixed into HTTPServer by _httpServerClass. Not derived from object so that this works with the old-style classes of Python 2.x
+    def __init__(self, localaddr, port, ms, httpTemplates, staticFiles, static_cache_secs, staticGzip=None):
+        self.ms = ms
+        self.httpTemplates = httpTemplates
+        self.staticFiles = staticFiles
+        self.staticGzip = staticGzip or {}
+        self.static_cache_secs = static_cache_secs
+        self._HTTPServer.__init__(self, (localaddr, port), self._RequestHandler)  # Required for Python 2.x since HTTPServer is an old-style class (uarg) there
+
+
+_httpServerClasses = []
+
+
+def _httpServerClass():
+    """ Import the HTTP server on first use. It is by far the slowest import, and not needed to accept mails. """
+    if not _httpServerClasses:
+        try:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+        except ImportError:  # Python 2.x
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+        class MockmailHttpRequestHandler(_MockmailHttpRequestHandler, BaseHTTPRequestHandler):
+            pass
+
+        class MockmailHttpServer(_MockmailHttpServer, HTTPServer):
+            _HTTPServer = HTTPServer
+            _RequestHandler = MockmailHttpRequestHandler
+
+        _httpServerClasses.append(MockmailHttpServer)
+    return _httpServerClasses[0]
+
+
+def MockmailHttpServer(*args, **kwargs):
+    return _httpServerClass()(*args, **kwargs)
+
+
+_MUSTACHE_TAG_RE = re.compile(r'\{\{(?P<type>[>{#/]?)(?P<name>[a-zA-Z0-9_]+)\}?\}\}')
+
+
+def _parseTemplate(template):
+    """ Parse a mustache template into a JSON-serializable list of nodes:
+    ['text', str], ['var', name], ['raw', name], ['partial', name] and ['section', name, nodes]
+    """
+    res = []
+    p = 0
+    while True:
+        m = _MUSTACHE_TAG_RE.search(template, p)
+        if not m:
+            break
+        if m.start() > p:
+            res.append(['text', template[p:m.start()]])
+
+        mtype = m.group('type')
+        name = m.group('name')
+        if mtype == '{':
+            res.append(['raw', name])
+        elif mtype == '>':
+            res.append(['partial', name])
+        elif mtype == '#':
+            close_tag = '{{/%s}}' % name
+            close_start = template.find(close_tag, m.end())
+            if close_start < 0:
+                raise ValueError('Cannot find closing {{/%s}}' % name)
+            res.append(['section', name, _parseTemplate(template[m.end():close_start])])
+            p = close_start + len(close_tag)
+            continue
+        elif mtype == '/':
+            raise ValueError('Closing unopened name %s' % name)
+        else:
+            assert not mtype
+            res.append(['var', name])
+
+        p = m.end()
+
+    if p < len(template):
+        res.append(['text', template[p:]])
+    return res
+
+
+class MustacheRenderer(object):
+    # a very simplistic renderer, sufficient for our very simplistic mustache
+    def __init__(self, templates):
+        """ @param templates A dictionary of template name to template source or the result of _parseTemplate """
+        self.templates = templates
+
+    def render(self, template, context):
+        return self._render_stack(template, [context])
+
+    def _render_stack(self, template, contexts):
+        if not isinstance(template, list):
+            template = _parseTemplate(template)
+        return ''.join(self._render_pieces(template, contexts))
+
+    def _lookup(self, stack, name):
+        for c in reversed(stack):
+            if name in c:
+                return c[name]
+        return ''
+
+    def _render_pieces(self, nodes, contexts):
+        for node in nodes:
+            ntype = node[0]
+            if ntype == 'text':
+                yield node[1]
+            elif ntype == 'raw':
+                yield compat_str(self._lookup(contexts, node[1]))
+            elif ntype == 'partial':
+                if node[1] not in self.templates:
+                    raise ValueError('Cannot find template %s ' % node[1])
+                yield self._render_stack(self.templates[node[1]], contexts)
+            elif ntype == 'section':
+                val = self._lookup(contexts, node[1])
+                if val:
+                    if not isinstance(val, list):
+                        raise ValueError('Refusing to iterate over %s (val %r)' % (type(val), val))
+
+                    for el in val:
+                        yield self._render_stack(node[2], contexts + [el])
+            else:
+                assert ntype == 'var'
+                yield html_escape(compat_str(self._lookup(contexts, node[1])))
+
+
+_MAILBOX_PATH_RE = re.compile(
+    r'^/mailboxes/(?P<name>[^/]+)/(?:export/(?P<export>mbox|maildir)|(?P<listing>mails\.json))?$')
+_EXPORT_PATH_RE = re.compile(r'^/export/(?P<export>mbox|maildir)$')
+_LISTING_MAX_COUNT = 1000
+_MAIL_PATH_RE = re.compile(r'^/mails/(?P<id>[^/]+)(?:/parts/(?P<part>[0-9]+)|/(?P<raw>raw))?$')
+_RANGE_RE = re.compile(r'^bytes=(?P<start>[0-9]*)-(?P<end>[0-9]*)$')
+
+
+def _sendfile(sock, f, count, offset=0):
+    """ Send count bytes from the file f, starting at offset, over sock, without copying them through userspace if possible """
+    if not hasattr(os, 'sendfile'):  # Python < 3.3 or non-POSIX
+        f.seek(offset)
+        while count > 0:
+            chunk = f.read(min(count, _CHUNK_SIZE))
+            if not chunk:
+                break
+            sock.sendall(chunk)
+            count -= len(chunk)
+        return
+
+    end = offset + count
+    while offset < end:
+        sent = os.sendfile(sock.fileno(), f.fileno(), offset, end - offset)
+        if sent == 0:  # File got truncated
+            break
+        offset += sent
+
+
+def _parseRange(header, size):
+    """
+    @returns A tuple (start, end) (end exclusive) of the bytes to serve, or None if the whole content should be served.
+    Raises a ValueError if the range cannot be satisfied. Invalid ranges are ignored, as RFC 7233 requires.
+    """
+    if not header:
+        return None
+    m = _RANGE_RE.match(header.strip())
+    if not m:  # Multiple or malformed ranges; we may ignore them and serve everything
+        return None
+    start_str, end_str = m.group('start'), m.group('end')
+    if not start_str:
+        if not end_str:
+            return None
+        suffix = int(end_str)
+        if suffix == 0:
+            raise ValueError('Empty suffix range')
+        return (max(size - suffix, 0), size)
+    start = int(start_str)
+    if end_str and int(end_str) < start:  # Invalid
+        return None
+    if start >= size:
+        raise ValueError('Range not satisfiable')
+    end = min(int(end_str) + 1, size) if end_str else size
+    return (start, end)
+
+
+class _MockmailHttpRequestHandler:
+    # Mixed into BaseHTTPRequestHandler by _httpServerClass. Not derived from object so that this works with the old-style classes of Python 2.x
+    def _serve_template(self, tname, context):
+        templates = self.server.httpTemplates
+        try:
+            renderer = MustacheRenderer(templates)
+            page = renderer.render(templates[tname], context)
+            pageBlob = page.encode('utf-8')
+        except:
+            self.send_error(500)
+            raise
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.end_headers()
+        self.wfile.write(pageBlob)
+
+    def _serve_static(self, fn, files, gzipFiles):
+        if fn not in files:
+            self.send_error(404)
+            return
+        gzipped = fn in gzipFiles and _acceptsGzip(self.headers.get('Accept-Encoding'))
+        content = gzipFiles[fn] if gzipped else files[fn]
+
+        self.send_response(200)
+        self.send_header('Content-Type', _contentType(fn))
+        self.send_header('Content-Length', compat_str(len(content)))
+        if gzipFiles:
+            self.send_header('Vary', 'Accept-Encoding')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        if self.server.static_cache_secs is not None:
+            import email.utils
+            self.send_header(
+                'Expires',
+                email.utils.formatdate(time.time() + self.server.static_cache_secs))
+            self.send_header(
+                'Cache-Control',
+                'public, max-age=' + compat_str(self.server.static_cache_secs))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _serve_part(self, mail, part_str):
+        try:
+            part = mail['bodies'][int(part_str)]
+        except IndexError:
+            self.send_error(404)
+            return
+        if 'size' not in part:  # multipart container
+            self.send_error(404)
+            return
+
+        size = part['size']
+        try:
+            rng = _parseRange(self.headers.get('Range'), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        f = None
+        if part.get('file'):  # spooled
+            try:
+                f = open(part['file'], 'rb')
+            except (OSError, IOError):
+                self.send_error(404)
+                return
+
+        if rng is None:
+            self.send_response(200)
+            start, end = 0, size
+        else:
+            start, end = rng
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, size))
+        length = end - start
+        contentType = part['content_type']
+        if contentType.startswith('text/'):
+            # Without a transfer encoding to undo, the text is served as decoded by parseMail
+            transferDecoded = (part['transfer_encoding'] or '').strip().lower() in ('base64', 'quoted-printable')
+            charset = part['charset'] if transferDecoded else 'utf-8'
+            if charset:
+                contentType += '; charset=' + charset
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', compat_str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        if part['filename']:
+            self.send_header(
+                'Content-Disposition',
+                "attachment; filename*=UTF-8''" + url_quote(part['filename'].encode('utf-8'), safe=''))
+        self.end_headers()
+        if f is None:
+            chunks = _iterDecodedPayload(part['payload'], part['transfer_encoding'])
+            for chunk in _sliceChunks(chunks, start, end):
+                self.wfile.write(chunk)
+            return
+        with f:
+            self.wfile.flush()
+            _sendfile(self.connection, f, length, start)
+
+    def _serve_raw(self, mail):
+        if mail['rawfile'] is None:
+            blob = mail['rawdata']
+            self.send_response(200)
+            self.send_header('Content-Type', 'message/rfc822')
+            self.send_header('Content-Length', compat_str(len(blob)))
+            self.end_headers()
+            self.wfile.write(blob)
+            return
+
+        try:
+            f = open(mail['rawfile'], 'rb')
+        except (OSError, IOError):
+            self.send_error(404)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header('Content-Type', 'message/rfc822')
+            self.send_header('Content-Length', compat_str(size))
+            self.end_headers()
+            self.wfile.flush()
+            _sendfile(self.connection, f, size)
+
+    def _serve_index(self, listingUrl, title):
+        # Only a shell; the rows are fetched by mockmail.js from the JSON listing
+        self._serve_template('index', {'listing': listingUrl, 'title': title})
+
+    def _serve_listing(self, mb, query):
+        """ Serve the mails of a mailbox, newest first, as compact JSON rows.
+        Query parameters until, after and count are passed on to Mailbox.listing. """
+        params = parse_qs(query)
+        try:
+            args = dict((k, int(params[k][-1])) for k in ('until', 'after', 'count') if k in params)
+        except ValueError:
+            self.send_error(400)
+            return
+        args['count'] = max(0, min(args.get('count', 100), _LISTING_MAX_COUNT))
+        if mb is None:
+            first, last, mails = 0, -1, []
+        else:
+            first, last, mails = mb.listing(**args)
+        rows = [[
+            m['seq'], m['id'], _formatTimestamp(m['receivedAt_epoch']),
+            m['from'], m['simple_to'], m['subject']] for m in mails]
+        blob = json.dumps({'first': first, 'last': last, 'rows': rows}, separators=(',', ':')).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', compat_str(len(blob)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(blob)
+
+    def _serve_export(self, mails, fmt):
+        mails = sorted(mails, key=lambda m: m['receivedAt_epoch'])
+        self.send_response(200)
+        if fmt == 'mbox':
+            self.send_header('Content-Type', 'application/mbox')
+            self.send_header('Content-Disposition', 'attachment; filename=mockmail.mbox')
+            self.end_headers()
+            for mail in mails:
+                self.wfile.write(_mboxEntry(mail))
+        else:
+            assert fmt == 'maildir'
+            self.send_header('Content-Type', 'application/x-tar')
+            self.send_header('Content-Disposition', 'attachment; filename=mockmail-maildir.tar')
+            self.end_headers()
+            _writeMaildirTar(self.wfile, mails)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        mailbox_m = _MAILBOX_PATH_RE.match(path)
+        mail_m = _MAIL_PATH_RE.match(path)
+        export_m = _EXPORT_PATH_RE.match(path)
+        if path == '/':
+            ms = self.server.ms
+            if ms.tenant_by is None:
+                self._serve_index('/mails.json', 'mockmailserver')
+                return
+            mailboxes = [{
+                'name': mb.name,
+                'url_name': url_quote(mb.name.encode('utf-8'), safe=''),
+                'count': len(mb),
+                'size': mb.size,
+            } for mb in ms.mailboxes]
+            self._serve_template('mailboxes', {'mailboxes': mailboxes, 'title': 'mockmailserver'})
+        elif mailbox_m:
+            name = url_unquote(mailbox_m.group('name'))
+            try:
+                mb = self.server.ms.getMailbox(name)
+            except KeyError:
+                self.send_error(404)
+                return
+            if mailbox_m.group('export'):
+                self._serve_export(mb.mails, mailbox_m.group('export'))
+            elif mailbox_m.group('listing'):
+                self._serve_listing(mb, query)
+            else:
+                self._serve_index(
+                    '/mailboxes/' + mailbox_m.group('name') + '/mails.json', 'mockmail - ' + name)
+        elif path == '/mails.json':
+            try:
+                mb = self.server.ms.getMailbox(_DEFAULT_TENANT)
+            except KeyError:  # No mail received yet
+                mb = None
+            self._serve_listing(mb, query)
+        elif export_m:
+            self._serve_export(self.server.ms.mails, export_m.group('export'))
+        elif mail_m:
+            try:
+                mail = self.server.ms.getById(mail_m.group('id'))
+            except KeyError:
+                self.send_error(404)
+                return
+            if mail_m.group('part') is not None:
+                self._serve_part(mail, mail_m.group('part'))
+                return
+            if mail_m.group('raw') is not None:
+                self._serve_raw(mail)
+                return
+            maildict = mail.copy()
+            maildict['title'] = 'mockmail - ' + maildict['subject']
+            maildict['receivedAt'] = _formatTimestamp(maildict['receivedAt_epoch'])
+            self._serve_template('mail', maildict)
+        elif path.startswith('/static/'):
+            fn = path[len('/static/'):]
+            self._serve_static(fn, self.server.staticFiles, self.server.staticGzip)
+        else:
+            self.send_error(404)
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+    def log_error(*args, **kwargs):
+        pass
+
+
+def _workaround_preload_codecs(encs=None):
+    """ Preload the codecs encs, or all available codecs if encs is None. """
+    import codecs
+    if encs is None:
+        import encodings
+        encs = set(
+            os.path.splitext(fn)[0]
+            for fn in os.listdir(os.path.dirname(encodings.__file__)))
+    for e in encs:
+        try:
+            codecs.lookup(e)
+        except LookupError:
+            pass  # __init__.py or something
+
+
+def _dropPrivileges(config, init_chroot=None):
+    """ @param init_chroot Callback function to call before creating the chroot """
+    uid = None
+    if config['dropuser'] is not None:
+        uname = config['dropuser']
+        gname = config['dropgroup']
+
+        if isinstance(uname, int):
+            uid = uname
+            if gname is None:
+                gname = pwd.getpwuid(uid).pw_gid
+        else:
+            pw = pwd.getpwnam(uname)
+            uid = pw.pw_uid
+            if gname is None:
+                gname = pw.pw_gid
+
+        if isinstance(gname, int):
+            gid = gname
+        else:
+            gid = grp.getgrnam(gname).gr_gid
+
+    if config['chroot']:
+        if config['chroot_mkdir']:
+            if not os.path.exists(config['chroot']):
+                os.mkdir(config['chroot'], 0o700)
+
+        for mod in _DEFERRED_MODULES:
+            __import__(mod)
+        if config['workarounds']:
+            _workaround_preload_codecs(config['preload_codecs'])
+
+        os.chroot(config['chroot'])
+        os.chdir('/')
+
+    if init_chroot:
+        init_chroot()
+
+    if uid is not None:
+        os.setgroups([])
+        os.setgid(gid)
+        os.setuid(uid)
+
+
+def _setupPidfile(pidfile):
+    if pidfile is None:
+        return
+    with open(pidfile, 'w') as pidf:
+        pidf.write(str(os.getpid()))
+
+
+def _getPid(pidfile):
+    """
+    @returns The process id of the running mockmail process, or None if it is not running.
+    """
+    if not pidfile:
+        raise Exception('No pidfile set! Use --pidfile or the "pidfile" configuration option')
+    try:
+        pidc = _readfile(pidfile)
+    except (OSError, IOError):
+        return None
+    if not pidc:
+        return None
+    try:
+        pid = int(pidc)
+    except ValueError:
+        return None
+    try:
+        cmdline = _readfile(os.path.join('/proc/', str(pid), 'cmdline'))
+        if b'mockmail' in cmdline:
+            return pid
+        else:  # Just another process that happens to have the same pid
+            return None
+    except IOError:
+        return None
+
+
+def _effectivePidfile(config):
+    if not config['pidfile']:
+        return None
+    if config['chroot']:
+        res = os.path.join(config['chroot'], config['pidfile'])
+    else:
+        res = config['pidfile']
+    return os.path.abspath(res)
+
+
+def _exportFromRunning(config, fmt, target):
+    """ Download all mails from the running mockmail instance into the mbox file or Maildir directory target """
+    import shutil
+    try:
+        from http.client import HTTPConnection
+    except ImportError:  # Python 2.x
+        from httplib import HTTPConnection
+
+    conn = HTTPConnection(config['httpaddr'] or 'localhost', config['httpport'])
+    try:
+        conn.request('GET', '/export/' + fmt)
+        resp = conn.getresponse()
+        if resp.status != 200:
+            raise Exception('Export failed: HTTP %d %s' % (resp.status, resp.reason))
+        if fmt == 'mbox':
+            with open(target, 'wb') as mboxf:
+                shutil.copyfileobj(resp, mboxf, _CHUNK_SIZE)
+        else:
+            _extractMaildirTar(resp, target)
+    finally:
+        conn.close()
+
+
+def mockmail(config):
+    ms = MailStore(
+        tenant_by=config['tenant_by'],
+        max_mails=config['max_mails'],
+        max_bytes=config['max_bytes'],
+        tenant_limits=config['tenant_limits'])
+
+    admission = _AdmissionControl(
+        max_sessions=config['max_sessions'],
+        max_pending_bytes=config['max_pending_bytes'],
+        peer_rate=config['peer_rate'],
+        peer_burst=config['peer_burst'])
+    try:
+        MockmailSmtpServer(config['smtpaddr'], config['smtpport'], ms, config['spooldir'], admission)
+    except socket.error:
+        if config['smtp_grace_period'] is not None:
+            time.sleep(config['smtp_grace_period'])
+            MockmailSmtpServer(config['smtpaddr'], config['smtpport'], ms, config['spooldir'], admission)
+        else:
+            raise
+
+    # Imported fixtures come before any mail received via SMTP
+    for mboxFn in config['import_mbox']:
+        with open(mboxFn, 'rb') as mboxf:
+            # Spooled files would end up outside of the chroot
+            importMbox(ms, mboxf, None if config['chroot'] else config['spooldir'])
+
+    # Without a fork or privilege changes ahead, accept mails while the web interface is still being set up
+    fastStart = not config['daemonize'] and not config['chroot'] and config['dropuser'] is None
+    smtpThread = threading.Thread(target=asyncore.loop)
+    smtpThread.daemon = True
+    if fastStart:
+        smtpThread.start()
+
+    httpTemplates, httpStatic, httpStaticGzip = _loadResources(config['resourcedir'], config['static_dev'])
+    httpSrv = MockmailHttpServer(
+        config['httpaddr'], config['httpport'], ms, httpTemplates, httpStatic, config['static_cache_secs'], httpStaticGzip)
+
+    if config['daemonize']:
+        if os.fork() != 0:
+            sys.exit(0)
+
+    _dropPrivileges(config, lambda: _setupPidfile(config['pidfile']))
+
+    if not fastStart:
+        smtpThread.start()
+
+    httpThread = threading.Thread(target=httpSrv.serve_forever)
+    httpThread.daemon = True
+    httpThread.start()
+
+    smtpThread.join()
+    httpThread.join()
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        '-c', '--config', dest='configfile', metavar='FILE',
+        help='JSON configuration file to load')
+    parser.add_option(
+        '-d', '--daemonize', action='store_const', const=True, dest='daemonize', default=None,
+        help='Run mockmail in the background. Overwrites configuration')
+    parser.add_option(
+        '-i', '--interactive', action='store_const', const=True, dest='daemonize', default=None,
+        help='Run mockmail in the foreground. Overwrites configuration')
+    parser.add_option(
+        '--resourcedir', dest='resourcedir', metavar='DIR',
+        help='Load resources and templates from this directrory')
+    parser.add_option(
+        '--pidfile', dest='pidfile', default=None,
+        help='Set pidfile to use. Overwrites configuration')
+    parser.add_option(
+        '--ctl-status', action='store_const', dest='ctl', const='status', default=None,
+        help='Check whether mockmail service is running.')
+    parser.add_option(
+        '--ctl-start',  action='store_const', dest='ctl', const='start',  default=None,
+        help='Start mockmail service.')
+    parser.add_option(
+        '--ctl-stop',   action='store_const', dest='ctl', const='stop',   default=None,
+        help='Stop mockmail  service.')
+    parser.add_option(
+        '--quiet-ctl', action='store_true', dest='quiet_ctl', default=False,
+        help='Do not print announcement in --ctl-* operations.')
+    parser.add_option(
+        '--dumpconfig', action='store_true', dest='dumpconfig',
+        help='Do not run mockmail, but dump the effective configuration')
+    parser.add_option(
+        '--version', action='store_true', dest='dumpversion',
+        help='Do not run mockmail, but output the version')
+    parser.add_option(
+        '--check-resourcedir', action='store_true', dest='check_resourcedir',
+        help='Do not run mockmail, but check that the resource directory is set correctly')
+    parser.add_option(
+        '--import-mbox', action='append', dest='import_mbox', metavar='FILE', default=[],
+        help='Load the messages in this mbox file into the mail store at startup. Can be given multiple times')
+    parser.add_option(
+        '--export-mbox', dest='export_mbox', metavar='FILE',
+        help='Do not run mockmail, but save all mails of the running mockmail to an mbox file')
+    parser.add_option(
+        '--export-maildir', dest='export_maildir', metavar='DIR',
+        help='Do not run mockmail, but save all mails of the running mockmail to a Maildir')
+    parser.add_option(
+        '--build-bundle', action='store_true', dest='build_bundle',
+        help='Do not run mockmail, but prebuild the resource bundle in the resource directory for faster startup')
+    opts, args = parser.parse_args()
+
+    if len(args) != 0:
+        parser.error('Did not expect any arguments. Use -c to specify a configuration file.')
+
+    if opts.dumpversion:
+        print(__version__)
+        return
+
+    config = {
+        'smtpaddr': '',     # IP address to bind the SMTP port on. The default allows anyone to send you emails.
+        'smtpport': 2525,     # SMTP port number. On unixoid systems, you will need superuser privileges to bind to a port < 1024
+        'httpaddr': '',       # IP address to bind the web interface on. The default allows anyone to see your mail.
+        'httpport': 2580,     # Port to bind the web interface on. You may want to configure your webserver on port 80 to proxy the connection.
+        'chroot': None,       # Specify the directory to chroot into.
+        'chroot_mkdir': False,  # Automatically create the chroot directory if it doesn't exist, and chroot is set.
+        'dropuser': None,     # User account (name or uid) to drop to, None to not drop privileges
+        'dropgroup': None,    # User group (name or gid) to drop into. By default, this is the primary group of the user.
+        'static_dev': False,  # Read static files on demand. Good for development (a reload will update the file), but should not be set in production
+        'daemonize': False,   # Whether mockmail should go into the background after having started
+        'pidfile': None,      # File to write the process ID of mockmail to (relative to the chroot)
+        'resourcedir': None,  # Directory to load templates and resources
+        'workarounds': True,  # Work around platform bugs
+        'static_cache_secs': 0,  # Cache duration for static files
+        'smtp_grace_period': None,  # Set to a number to wait that long to open a port
+        'tenant_by': None,    # Partition mails into mailboxes by recipient "domain", plus-address "tag" or "helo" name. None for a single mailbox
+        'max_mails': None,    # Maximum number of mails per mailbox; the oldest mails are discarded first. None for unlimited
+        'max_bytes': None,    # Maximum total size of the mails per mailbox; the oldest mails are discarded first. None for unlimited
+        'tenant_limits': {},  # Override max_mails and max_bytes for individual mailboxes, e.g. {"example.com": {"max_mails": 100}}
+        'max_sessions': None,  # Maximum number of concurrent SMTP sessions; further connections are refused with 421. None for unlimited
+        'max_pending_bytes': None,  # Maximum total size of messages being received; excess gets 452 (552 if one message is bigger). None for unlimited
+        'peer_rate': None,    # Maximum sustained number of messages per second from one IP address; excess MAIL FROM is refused with 450. None for unlimited
+        'peer_burst': 10,     # Number of messages an IP address may send in a row before peer_rate applies
+        'import_mbox': [],    # mbox files to load into the mail store at startup
+        'preload_codecs': None,  # Codecs to load before entering the chroot (if workarounds is set), e.g. ["ascii", "utf-8"]. null for all available codecs
+        'spooldir': None,     # Existing directory (relative to the chroot) to write raw messages and parts to; only decoded texts stay in memory
+    }
+    if opts.configfile:
+        with open(opts.configfile, 'r') as cfgf:
+            config.update(json.load(cfgf))
+    if opts.daemonize is not None:
+        config['daemonize'] = opts.daemonize
+    if opts.pidfile is not None:
+        config['pidfile'] = opts.pidfile
+    if opts.resourcedir is not None:
+        config['resourcedir'] = opts.resourcedir
+    config['import_mbox'] = config['import_mbox'] + opts.import_mbox
+
+    if opts.dumpconfig:
+        json.dump(config, sys.stdout, indent=4)
+        sys.stdout.write('\n')
+        return
+
+    if config['resourcedir'] is None:
+        config['resourcedir'] = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'share', 'mockmail'))
+
+    if opts.export_mbox:
+        _exportFromRunning(config, 'mbox', opts.export_mbox)
+        return
+    if opts.export_maildir:
+        _exportFromRunning(config, 'maildir', opts.export_maildir)
+        return
+
+    if opts.build_bundle:
+        print('Wrote ' + _buildBundle(config['resourcedir']))
+        return
+
+    if opts.check_resourcedir:
+        print('Loading resources from ' + os.path.abspath(config['resourcedir']) + ' ...')
+
+        _readResources(config['resourcedir'])
+        sys.exit(0)
+
+    ctl_print = (lambda s: 0) if opts.quiet_ctl else sys.stdout.write
+    if opts.ctl == 'status':
+        pid = _getPid(_effectivePidfile(config))
+        if pid:
+            ctl_print('mockmail is running.\n')
+            sys.exit(0)
+        else:
+            ctl_print('mockmail is NOT running.\n')
+            sys.exit(3)
+    elif opts.ctl == 'start':
+        pid = _getPid(_effectivePidfile(config))
+        ctl_print('Starting Test MTA: mockmail')
+        if pid:
+            sys.stdout.write(' (pid ' + str(pid) + ') already running.\n')
+            sys.exit(0)
+        else:
+            config['daemonize'] = True
+            mockmail(config)
+            ctl_print('.\n')
+            return
+    elif opts.ctl == 'stop':
+        pidfn = _effectivePidfile(config)
+        pid = _getPid(pidfn)
+        ctl_print('Stopping Test MTA: mockmail ...')
+        if pid:
+            os.kill(pid, signal.SIGTERM)
+            try:
+                os.unlink(pidfn)
+            except OSError:
+                pass
+        ctl_print('.\n')
+        sys.exit(0)
+
+    if config['pidfile']:
+        pid = _getPid(_effectivePidfile(config))
+        if pid:
+            raise Exception(
+                'mockmail is already running (pid %s), read from %s' %
+                (pid, _effectivePidfile(config)))
+
+    mockmail(config)
+
+
+if __name__ == '__main__':
+    main()
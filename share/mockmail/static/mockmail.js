@@ -1,34 +1,69 @@
+function splitRaw(raw) {
+	var p = raw.indexOf('\r\n\r\n');
+	if (p >= 0) {
+		return {header: raw.substr(0, p), body: raw.substr(p + 4)};
+	}
+	p = raw.indexOf('\n\n');
+	if (p >= 0) {
+		return {header: raw.substr(0, p), body: raw.substr(p + 2)};
+	}
+	return {header: raw, body: ''};
+}
+
+function withRaw(email_container, callback) {
+	var cached = email_container.data('raw');
+	if (cached) {
+		callback(cached);
+		return;
+	}
+	$.ajax({
+		url: '/mails/' + email_container.attr('data-id') + '/raw',
+		dataType: 'text',
+		success: function(raw) {
+			var split = splitRaw(raw);
+			email_container.data('raw', split);
+			callback(split);
+		}
+	});
+}
+
 function rawHeader_toggle() {
 	var link = $(this);
-	var emailHeader = link.parent().parent().children('.header');
+	var email_container = link.parent().parent();
+	var emailHeader = email_container.children('.header');
 	var rawDisplay = emailHeader.children('.header_raw');
 	if (rawDisplay.length > 0) {
 		rawDisplay.remove();
 		emailHeader.children('.header_parsed').show();
 		link.text('Show raw header');
 	} else {
-		var rawDisplay = $('<div class="raw header_raw"></div>');
-		rawDisplay.text(emailHeader.attr('data-rawheader'));
-		emailHeader.append(rawDisplay);
-		emailHeader.children('.header_parsed').hide();
-		link.text('Show parsed header');
+		withRaw(email_container, function(raw) {
+			var rawDisplay = $('<div class="raw header_raw"></div>');
+			rawDisplay.text(raw.header);
+			emailHeader.append(rawDisplay);
+			emailHeader.children('.header_parsed').hide();
+			link.text('Show parsed header');
+		});
 	}
 }
 
 function rawBody_toggle() {
 	var link = $(this);
-	var emailBody = link.parent().parent().children('.body');
+	var email_container = link.parent().parent();
+	var emailBody = email_container.children('.body');
 	var rawDisplay = emailBody.children('.body_raw');
 	if (rawDisplay.length > 0) {
 		rawDisplay.remove();
 		emailBody.children('.body_parsed').show();
 		link.text('Show raw body');
 	} else {
-		var rawDisplay = $('<div class="raw body_raw"></div>');
-		rawDisplay.text(emailBody.attr('data-rawbody'));
-		emailBody.append(rawDisplay);
-		emailBody.children('.body_parsed').hide();
-		link.text('Show parsed body');
+		withRaw(email_container, function(raw) {
+			var rawDisplay = $('<div class="raw body_raw"></div>');
+			rawDisplay.text(raw.body);
+			emailBody.append(rawDisplay);
+			emailBody.children('.body_parsed').hide();
+			link.text('Show parsed body');
+		});
 	}
 }
 
@@ -47,6 +82,158 @@ function rawEnvelope_toggle() {
 	}
 }
 
+var MAILLIST_ROW_HEIGHT = 28;  // Pixels, must match .maillist_row in mockmail.css
+var MAILLIST_PAGE_SIZE = 100;
+var MAILLIST_OVERSCAN = 20;  // Rows rendered above and below the visible ones
+var MAILLIST_KEEP_PAGES = 5;  // Pages kept in memory above and below the visible rows
+var MAILLIST_POLL_INTERVAL = 3000;
+
+function escapeHTML(s) {
+	return String(s).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+}
+
+// Virtualized list of mails. Only the rows in view are in the DOM, and they are fetched page by page from the JSON listing.
+// Rows are identified by the sequence number of the mail; row i (from the top) shows the mail with sequence number last - i.
+function MailList(container) {
+	this.url = container.attr('data-listing');
+	this.viewport = container.children('.maillist_viewport');
+	this.canvas = this.viewport.children('.maillist_canvas');
+	this.first = 0;
+	this.last = -1;
+	this.rows = {};  // Row data by sequence number
+	this.pages = {};  // By page number: value of last when the page was fetched
+	this.loading = {};  // Page numbers currently being fetched
+	this.renderScheduled = false;
+
+	var self = this;
+	this.viewport.scroll(function() {self.scheduleRender();});
+	$(window).resize(function() {self.scheduleRender();});
+	this.poll();
+}
+
+MailList.prototype.update = function(data) {
+	var added = Math.max(0, data.last - this.last);
+	var wasScrolled = this.viewport.scrollTop() > 0;
+	this.first = Math.max(this.first, data.first);
+	this.last = Math.max(this.last, data.last);
+	for (var i = 0; i < data.rows.length; i++) {
+		this.rows[data.rows[i][0]] = data.rows[i];
+	}
+	this.canvas.css('height', (this.last - this.first + 1) * MAILLIST_ROW_HEIGHT + 'px');
+	if (added > 0 && wasScrolled) {
+		// New mails are prepended; keep the rows the user is looking at in place
+		this.viewport.scrollTop(this.viewport.scrollTop() + added * MAILLIST_ROW_HEIGHT);
+	}
+	this.render();
+};
+
+MailList.prototype.poll = function() {
+	var self = this;
+	$.ajax({
+		url: this.url,
+		data: {after: this.last, count: MAILLIST_PAGE_SIZE},
+		dataType: 'json',
+		cache: false,
+		success: function(data) {self.update(data);},
+		complete: function() {
+			setTimeout(function() {self.poll();}, MAILLIST_POLL_INTERVAL);
+		}
+	});
+};
+
+MailList.prototype.pageLoaded = function(page) {
+	var pageEnd = page * MAILLIST_PAGE_SIZE + MAILLIST_PAGE_SIZE - 1;
+	return (page in this.pages) && this.pages[page] >= Math.min(pageEnd, this.last);
+};
+
+MailList.prototype.loadPage = function(page) {
+	var self = this;
+	this.loading[page] = true;
+	$.ajax({
+		url: this.url,
+		data: {until: page * MAILLIST_PAGE_SIZE + MAILLIST_PAGE_SIZE - 1, count: MAILLIST_PAGE_SIZE},
+		dataType: 'json',
+		cache: false,
+		success: function(data) {
+			delete self.loading[page];
+			self.pages[page] = data.last;
+			self.update(data);
+		},
+		error: function() {
+			delete self.loading[page];
+		}
+	});
+};
+
+MailList.prototype.scheduleRender = function() {
+	if (this.renderScheduled) {
+		return;
+	}
+	this.renderScheduled = true;
+	var self = this;
+	setTimeout(function() {self.render();}, 16);
+};
+
+MailList.prototype.renderRow = function(index, row) {
+	var style = ' style="top: ' + (index * MAILLIST_ROW_HEIGHT) + 'px"';
+	if (!row) {
+		return '<div class="maillist_row"' + style + '></div>';
+	}
+	return (
+		'<a class="maillist_row" href="/mails/' + escapeHTML(encodeURIComponent(row[1])) + '"' + style + '>' +
+		'<span class="maillist_received">' + escapeHTML(row[2]) + '</span>' +
+		'<span class="maillist_from">' + escapeHTML(row[3]) + '</span>' +
+		'<span class="maillist_to">' + escapeHTML(row[4]) + '</span>' +
+		'<span class="maillist_subject">' + escapeHTML(row[5]) + '</span>' +
+		'</a>');
+};
+
+MailList.prototype.render = function() {
+	this.renderScheduled = false;
+	var total = this.last - this.first + 1;
+	var scrollTop = this.viewport.scrollTop();
+	var start = Math.max(0, Math.floor(scrollTop / MAILLIST_ROW_HEIGHT) - MAILLIST_OVERSCAN);
+	var end = Math.min(total, Math.ceil((scrollTop + this.viewport.height()) / MAILLIST_ROW_HEIGHT) + MAILLIST_OVERSCAN);
+
+	var html = [];
+	for (var i = start; i < end; i++) {
+		var seq = this.last - i;
+		var row = this.rows[seq];
+		var page = Math.floor(seq / MAILLIST_PAGE_SIZE);
+		if (!row && !this.loading[page] && !this.pageLoaded(page)) {
+			this.loadPage(page);
+		}
+		html.push(this.renderRow(i, row));
+	}
+	if (total <= 0) {
+		html.push('<div class="maillist_empty">No mails received yet.</div>');
+	}
+	this.canvas.html(html.join(''));
+
+	// Forget rows far away from the visible ones, so that memory use does not grow with the number of mails
+	var keep = MAILLIST_KEEP_PAGES * MAILLIST_PAGE_SIZE;
+	var minSeq = this.last - end - keep;
+	var maxSeq = this.last - start + keep;
+	for (var key in this.rows) {
+		var s = parseInt(key, 10);
+		if (s < minSeq || s > maxSeq) {
+			delete this.rows[key];
+		}
+	}
+	for (var key in this.pages) {
+		var p = parseInt(key, 10);
+		if ((p + 1) * MAILLIST_PAGE_SIZE <= minSeq || p * MAILLIST_PAGE_SIZE > maxSeq) {
+			delete this.pages[key];
+		}
+	}
+};
+
+$(function() {
+	$('.maillist').each(function(i, container) {
+		new MailList($(container));
+	});
+});
+
 $(function() {
 	$('.email').each(function (i, email_container) {
 		var commandlinks = $('<div class="commandlinks"></div>');
@@ -66,5 +253,10 @@ $(function() {
 		rb_link.text('Show raw body');
 		rb_link.click(rawBody_toggle);
 		$(commandlinks).append(rb_link);
+
+		var dl_link = $('<a></a>');
+		dl_link.attr('href', '/mails/' + $(email_container).attr('data-id') + '/raw');
+		dl_link.text('Download raw message');
+		$(commandlinks).append(dl_link);
 	});
 });
\ No newline at end of file
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+try:
+    from . import tutils
+except (ImportError, ValueError):  # direct exection
+    import tutils  # NOQA
+
+import mockmail
+
+import asyncore
+import socket
+import sys
+import threading
+import unittest
+
+
+class AdmissionControlTestCase(unittest.TestCase):
+    def test_sessions(self):
+        ac = mockmail._AdmissionControl(max_sessions=2)
+        self.assertTrue(ac.openSession())
+        self.assertTrue(ac.openSession())
+        self.assertFalse(ac.openSession())
+        ac.closeSession()
+        self.assertTrue(ac.openSession())
+
+    def test_pendingBytes(self):
+        ac = mockmail._AdmissionControl(max_pending_bytes=100)
+        self.assertTrue(ac.reserveBytes(60))
+        self.assertFalse(ac.reserveBytes(60))
+        self.assertFalse(ac.overloaded)
+        self.assertTrue(ac.reserveBytes(40))
+        self.assertTrue(ac.overloaded)
+        ac.releaseBytes(100)
+        self.assertFalse(ac.overloaded)
+        self.assertEqual(ac.peakPendingBytes, 100)
+        self.assertFalse(ac.tooBig(100))
+        self.assertTrue(ac.tooBig(101))
+        self.assertFalse(mockmail._AdmissionControl().tooBig(10 ** 9))
+
+    def test_peer_rate(self):
+        ac = mockmail._AdmissionControl(peer_rate=1, peer_burst=2)
+        self.assertTrue(ac.allowMessage('192.0.2.1', now=1000))
+        self.assertTrue(ac.allowMessage('192.0.2.1', now=1000))
+        self.assertFalse(ac.allowMessage('192.0.2.1', now=1000))
+        self.assertTrue(ac.allowMessage('192.0.2.2', now=1000))
+        self.assertFalse(ac.allowMessage('192.0.2.1', now=1000.5))
+        self.assertTrue(ac.allowMessage('192.0.2.1', now=1001.5))
+
+        self.assertTrue(mockmail._AdmissionControl().allowMessage('192.0.2.1'))
+
+
+class _SmtpClient(object):
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.f = self.sock.makefile('rb')
+
+    def reply(self):
+        return self.f.readline().decode('ascii')
+
+    def command(self, line):
+        self.sock.sendall(line.encode('ascii') + b'\r\n')
+        return self.reply()
+
+    def close(self):
+        self.f.close()
+        self.sock.close()
+
+
+@unittest.skipIf(sys.version_info < (3,), 'Admission control requires Python 3')
+class OverloadTestCase(unittest.TestCase):
+    def _start(self, admission):
+        self.ms = mockmail.MailStore()
+        self.server = mockmail.MockmailSmtpServer('127.0.0.1', 0, self.ms, admission=admission)
+        self.port = self.server.socket.getsockname()[1]
+        self._stopped = False
+
+        def loop():
+            while not self._stopped:
+                asyncore.loop(timeout=0.01, count=1)
+        self.thread = threading.Thread(target=loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self._stopped = True
+        self.thread.join()
+        asyncore.close_all()
+
+    def test_max_sessions(self):
+        admission = mockmail._AdmissionControl(max_sessions=2)
+        self._start(admission)
+        clients = [_SmtpClient(self.port) for _ in range(2)]
+        for c in clients:
+            self.assertTrue(c.reply().startswith('220 '))
+
+        refused = _SmtpClient(self.port)
+        self.assertTrue(refused.reply().startswith('421 '))
+        refused.close()
+
+        self.assertTrue(clients[0].command('QUIT').startswith('221 '))
+        self.assertEqual(clients[0].reply(), '')  # Wait for the server to close the session
+        clients[0].close()
+        clients[0] = _SmtpClient(self.port)
+        self.assertTrue(clients[0].reply().startswith('220 '))
+        for c in clients:
+            c.close()
+
+    def test_pending_bytes_bounded(self):
+        limit = 256 * 1024
+        admission = mockmail._AdmissionControl(max_pending_bytes=limit)
+        self._start(admission)
+
+        body = b'Subject: big\r\n\r\n' + (b'x' * 1000 + b'\r\n') * 100  # ~100 KB
+        clients = [_SmtpClient(self.port) for _ in range(10)]
+        for c in clients:
+            c.reply()
+            c.command('HELO client')
+            c.command('MAIL FROM:<from@example.com>')
+            c.command('RCPT TO:<to@example.com>')
+            c.command('DATA')
+        # All clients send at once, far more than the server is willing to buffer
+        for c in clients:
+            c.sock.sendall(body)
+        results = []
+        for c in clients:
+            c.sock.sendall(b'.\r\n')
+            results.append(c.reply())
+            c.close()
+
+        accepted = [r for r in results if r.startswith('250 ')]
+        refused = [r for r in results if r.startswith('452 ')]
+        self.assertEqual(len(accepted) + len(refused), len(clients))
+        self.assertTrue(accepted)
+        self.assertTrue(refused)
+        self.assertTrue(admission.peakPendingBytes <= limit)
+        self.assertEqual(len(self.ms.mails), len(accepted))
+
+    def test_peer_rate(self):
+        self._start(mockmail._AdmissionControl(peer_rate=0.001, peer_burst=2))
+        c = _SmtpClient(self.port)
+        c.reply()
+        c.command('HELO client')
+        for _ in range(2):
+            self.assertTrue(c.command('MAIL FROM:<from@example.com>').startswith('250 '))
+            c.command('RCPT TO:<to@example.com>')
+            c.command('DATA')
+            self.assertTrue(c.command('Subject: hi\r\n\r\nhi\r\n.').startswith('250 '))
+        # Refused before the peer gets to send anything
+        self.assertTrue(c.command('MAIL FROM:<from@example.com>').startswith('450 '))
+        self.assertTrue(c.command('DATA').startswith('503 '))
+        c.close()
+        self.assertEqual(len(self.ms.mails), 2)
+
+    def test_too_big(self):
+        admission = mockmail._AdmissionControl(max_pending_bytes=1024)
+        self._start(admission)
+        c = _SmtpClient(self.port)
+        c.reply()
+        c.command('HELO client')
+        c.command('MAIL FROM:<from@example.com>')
+        c.command('RCPT TO:<to@example.com>')
+        c.command('DATA')
+        c.sock.sendall(b'Subject: big\r\n\r\n' + (b'x' * 100 + b'\r\n') * 20)
+        self.assertTrue(c.command('.').startswith('552 5.3.4 '))
+        self.assertTrue(c.command('MAIL FROM:<from@example.com>').startswith('250 '))
+        c.close()
+        self.assertEqual(len(self.ms.mails), 0)
+        self.assertEqual(admission.pendingBytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
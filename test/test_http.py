@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+try:
+    from . import tutils
+except (ImportError, ValueError):  # direct exection
+    import tutils  # NOQA
+
+import mockmail
+from mockmail import compat_str
+
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.client import HTTPConnection
+except ImportError:  # Python 2.x
+    from httplib import HTTPConnection
+
+
+_RESOURCEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'share', 'mockmail')
+
+_MAIL = '''To: to@phihag.de
+Subject: attached
+Content-Type: multipart/mixed; boundary="XXX"
+
+--XXX
+Content-Type: text/plain; charset=UTF-8
+
+see attachment
+--XXX
+Content-Type: application/octet-stream; name="data.bin"
+Content-Disposition: attachment; filename="data.bin"
+Content-Transfer-Encoding: base64
+
+AAECAwQFBgcICQ==
+--XXX--
+'''
+
+
+class HttpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ms = mockmail.MailStore()
+        self.ms.add(mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['to@phihag.de'], _MAIL))
+
+        templates, static = mockmail._readResources(_RESOURCEDIR)
+        self.server = mockmail.MockmailHttpServer('127.0.0.1', 0, self.ms, templates, static, None)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, path, headers={}):
+        conn = HTTPConnection('127.0.0.1', self.server.server_address[1])
+        try:
+            conn.request('GET', path, headers=headers)
+            resp = conn.getresponse()
+            return resp.status, dict((k.lower(), v) for k, v in resp.getheaders()), resp.read()
+        finally:
+            conn.close()
+
+    def test_mail(self):
+        status, headers, body = self._get('/mails/0')
+        self.assertEqual(status, 200)
+        self.assertTrue(b'href="/mails/0/parts/2"' in body)
+
+        self.assertEqual(self._get('/mails/1')[0], 404)
+        self.assertEqual(self._get('/mails/x')[0], 404)
+
+    def test_part(self):
+        status, headers, body = self._get('/mails/0/parts/2')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09')
+        self.assertEqual(headers['content-length'], '10')
+        self.assertEqual(headers['content-type'], 'application/octet-stream')
+        self.assertEqual(headers['content-disposition'], "attachment; filename*=UTF-8''data.bin")
+
+        status, headers, body = self._get('/mails/0/parts/1')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'see attachment')
+        self.assertEqual(headers['content-type'], 'text/plain; charset=utf-8')
+
+        self.assertEqual(self._get('/mails/0/parts/0')[0], 404)
+        self.assertEqual(self._get('/mails/0/parts/3')[0], 404)
+
+    def test_part_range(self):
+        status, headers, body = self._get('/mails/0/parts/2', {'Range': 'bytes=3-5'})
+        self.assertEqual(status, 206)
+        self.assertEqual(body, b'\x03\x04\x05')
+        self.assertEqual(headers['content-range'], 'bytes 3-5/10')
+
+        status, headers, body = self._get('/mails/0/parts/2', {'Range': 'bytes=-2'})
+        self.assertEqual(status, 206)
+        self.assertEqual(body, b'\x08\x09')
+
+        status, headers, body = self._get('/mails/0/parts/2', {'Range': 'bytes=5-4'})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body), 10)
+
+        status, headers, body = self._get('/mails/0/parts/2', {'Range': 'bytes=10-'})
+        self.assertEqual(status, 416)
+        self.assertEqual(headers['content-range'], 'bytes */10')
+
+    def test_raw(self):
+        status, headers, body = self._get('/mails/0/raw')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'message/rfc822')
+        self.assertEqual(body, _MAIL.encode('utf-8'))
+
+        status, headers, body = self._get('/mails/0')
+        self.assertFalse(b'data-rawbody' in body)
+
+        # 8bit content that is not UTF-8 is served unchanged
+        raw = b'Subject: latin-1\r\nContent-Type: text/plain; charset=iso-8859-1\r\n\r\n\xfcber\r\n'
+        smtpServer = mockmail.MockmailSmtpServer('127.0.0.1', 0, self.ms)
+        smtpServer.close()
+        smtpServer.process_message(('127.0.0.1', 4242), 'from@phihag.de', ['to@phihag.de'], raw)
+        self.assertEqual(self.ms.getById('1')['size'], len(raw))
+        status, headers, body = self._get('/mails/1/raw')
+        self.assertEqual(body, raw)
+        self.assertEqual(headers['content-length'], compat_str(len(raw)))
+        self.assertTrue(raw in self._get('/export/mbox')[2])
+
+    def test_raw_spooled(self):
+        spooldir = tempfile.mkdtemp()
+        try:
+            smtpServer = mockmail.MockmailSmtpServer('127.0.0.1', 0, self.ms, spooldir)
+            smtpServer.close()
+            smtpServer.process_message(('127.0.0.1', 4242), 'from@phihag.de', ['to@phihag.de'], _MAIL.encode('utf-8'))
+            mail = self.ms.getById('1')
+            self.assertEqual(mail['rawdata'], None)
+            self.assertEqual(os.path.dirname(mail['rawfile']), spooldir)
+
+            self.assertEqual(mail['size'], os.path.getsize(mail['rawfile']))
+            self.assertEqual([b['payload'] for b in mail['bodies']], [None, None, None])
+            self.assertEqual(os.path.getsize(mail['bodies'][2]['file']), 10)
+            self.assertEqual(mail['bodies'][1]['text'], 'see attachment')
+
+            status, headers, body = self._get('/mails/1/raw')
+            self.assertEqual(status, 200)
+            self.assertEqual(headers['content-length'], compat_str(len(body)))
+            self.assertEqual(body, _MAIL.encode('utf-8'))
+
+            status, headers, body = self._get('/mails/1/parts/2', {'Range': 'bytes=3-5'})
+            self.assertEqual(status, 206)
+            self.assertEqual(headers['content-length'], '3')
+            self.assertEqual(body, b'\x03\x04\x05')
+
+            status, headers, body = self._get('/mails/1/parts/2')
+            self.assertEqual(status, 200)
+            self.assertEqual(body, b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09')
+
+            self.ms.delete(lambda m: m['id'] != '1')
+            self.assertEqual(os.listdir(spooldir), [])
+        finally:
+            shutil.rmtree(spooldir)
+
+    def test_static_gzip(self):
+        status, headers, body = self._get('/static/mockmail.css', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'text/css')
+        self.assertFalse('content-encoding' in headers)
+
+        self.server.staticGzip = {'mockmail.css': mockmail._gzip(self.server.staticFiles['mockmail.css'])}
+        status, headers, gzBody = self._get('/static/mockmail.css', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(gzBody)).read(), body)
+
+        status, headers, plainBody = self._get('/static/mockmail.css')
+        self.assertFalse('content-encoding' in headers)
+        self.assertEqual(plainBody, body)
+
+    def test_export(self):
+        status, headers, body = self._get('/export/mbox')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/mbox')
+        self.assertTrue(body.startswith(b'From from@phihag.de '))
+        self.assertTrue(body.endswith(b'\n\n'))
+
+        status, headers, body = self._get('/export/maildir')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/x-tar')
+        self.assertTrue(_MAIL.encode('utf-8') in body)
+
+        self.assertEqual(self._get('/export/zip')[0], 404)
+
+    def test_listing(self):
+        for i in range(4):
+            self.ms.add(mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['to@phihag.de'], _MAIL))
+
+        status, headers, body = self._get('/')
+        self.assertEqual(status, 200)
+        self.assertTrue(b'data-listing="/mails.json"' in body)
+        self.assertFalse(b'href="/mails/0"' in body)
+
+        def listing(query=''):
+            status, headers, body = self._get('/mails.json' + query)
+            self.assertEqual(status, 200)
+            self.assertEqual(headers['content-type'], 'application/json')
+            data = json.loads(body.decode('utf-8'))
+            return data['first'], data['last'], [r[0] for r in data['rows']]
+
+        self.assertEqual(listing(), (0, 4, [4, 3, 2, 1, 0]))
+        self.assertEqual(listing('?until=3&count=2'), (0, 4, [3, 2]))
+        self.assertEqual(listing('?after=2'), (0, 4, [4, 3]))
+        self.assertEqual(listing('?count=0'), (0, 4, []))
+        self.assertEqual(self._get('/mails.json?count=x')[0], 400)
+
+        status, headers, body = self._get('/mails.json?count=1')
+        row = json.loads(body.decode('utf-8'))['rows'][0]
+        self.assertEqual(row[1:2] + row[3:], ['4', 'from@phihag.de', 'to@phihag.de', 'attached'])
+
+        self.server.ms = mockmail.MailStore()
+        self.assertEqual(listing(), (0, -1, []))
+
+    def test_mailboxes(self):
+        self.server.ms = mockmail.MailStore('domain')
+        self.server.ms.add(mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['a@team-a.org'], _MAIL))
+        self.server.ms.add(mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['b@team-b.org'], _MAIL))
+
+        status, headers, body = self._get('/')
+        self.assertEqual(status, 200)
+        self.assertTrue(b'href="/mailboxes/team-a.org/"' in body)
+        self.assertTrue(b'href="/mailboxes/team-b.org/"' in body)
+
+        status, headers, body = self._get('/mailboxes/team-b.org/')
+        self.assertEqual(status, 200)
+        self.assertTrue(b'data-listing="/mailboxes/team-b.org/mails.json"' in body)
+
+        status, headers, body = self._get('/mailboxes/team-b.org/mails.json')
+        self.assertEqual(status, 200)
+        rows = json.loads(body.decode('utf-8'))['rows']
+        self.assertEqual([r[1] for r in rows], ['1'])
+
+        self.assertEqual(self._get('/mailboxes/team-c.org/')[0], 404)
+
+        status, headers, body = self._get('/mailboxes/team-b.org/export/mbox')
+        self.assertEqual(status, 200)
+        self.assertEqual(body.count(b'\nFrom ') + body.startswith(b'From '), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
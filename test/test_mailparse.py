@@ -20,6 +20,38 @@ class MailparseTestCase(unittest.TestCase):
         inp = '=?utf-8?q?Registrierungsversuch_fehlgeschlagen_=28phihag=40phihag=2Ede=29?='
         assert mockmail._decodeMailHeader(inp) == 'Registrierungsversuch fehlgeschlagen (phihag@phihag.de)'
 
+        res = mockmail._decodeMailHeader('=?UTF-8?B?w5xtbMOkdXRl?= 2')
+        assert res.startswith(mockmail._decodeMailHeader('=?UTF-8?B?w5xtbMOkdXRl?='))
+        assert res.endswith('2')
+        assert mockmail._decodeMailHeader('plain') == 'plain'
+
+        # Unknown charsets must not prevent receiving the mail
+        assert mockmail._decodeMailHeader('=?x-no-such-charset?q?=FCber?=') == '\xfcber'
+
+    def test_memoCache(self):
+        calls = []
+
+        def f(x):
+            calls.append(x)
+            return x * 2
+
+        cache = mockmail._MemoCache(f, maxsize=2)
+        self.assertEqual(cache(1), 2)
+        self.assertEqual(cache(1), 2)
+        self.assertEqual(calls, [1])
+        for i in range(10):
+            cache(i)
+        self.assertTrue(len(cache._cache) <= 2)
+
+    def test_receivedAtNow(self):
+        try:
+            self.assertEqual(mockmail._receivedAtNow(now=2000000000.5), 2000000000)
+            self.assertEqual(mockmail._receivedAtNow(now=1999999990.0), 2000000000)  # clock turned back
+        finally:
+            mockmail._lastReceivedAt[0] = 0
+        self.assertTrue(isinstance(mockmail._receivedAtNow(), int))
+        self.assertEqual(mockmail._formatTimestamp(0), mockmail._formatTimestamp(0))
+
     def test_parseMail(self):
         data = '''To: Philipp Hagemeister <otherto@phihag.de>
 Subject: =?UTF-8?B?w5xtbMOkdXRlIDI=?=
@@ -31,6 +63,7 @@ w5xtbMOkdTx0ZQ=='''
 
         self.assertEqual(res['peer_ip'], '::1')
         self.assertEqual(res['peer_port'], 4242)
+        self.assertTrue(isinstance(res['receivedAt_epoch'], int))
 
         self.assertEqual(res['from'], 'from@phihag.de')
         self.assertEqual(res['simple_to'], 'Philipp Hagemeister <otherto@phihag.de>')
@@ -40,6 +73,131 @@ w5xtbMOkdTx0ZQ=='''
         self.assertEqual(res['bodies'][0]['html'].encode('UTF-8'), b'\xc3\x9cml\xc3\xa4u&lt;te')
         self.assertEqual(len(res['bodies']), 1)
 
+    def test_unknownCharset(self):
+        data = '''Subject: =?x-no-such-charset?q?=FCber?=
+Content-Type: text/plain; charset=x-no-such-charset
+Content-Transfer-Encoding: quoted-printable
+
+=FCber'''
+        res = mockmail.parseMail(('::1', 4242), 'from@phihag.de', ['to@phihag.de'], data)
+        self.assertEqual(res['subject'], '\xfcber')
+        self.assertEqual(res['bodies'][0]['text'], '\xfcber')
+
+    def test_attachment(self):
+        data = '''To: to@phihag.de
+Subject: attached
+Content-Type: multipart/mixed; boundary="XXX"
+
+--XXX
+Content-Type: text/plain; charset=UTF-8
+
+see attachment
+--XXX
+Content-Type: application/octet-stream; name="data.bin"
+Content-Disposition: attachment; filename="data.bin"
+Content-Transfer-Encoding: base64
+
+AAEC
+AwQF
+Bg==
+--XXX--
+'''
+        res = mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['to@phihag.de'], data)
+        self.assertEqual(len(res['bodies']), 3)
+        self.assertEqual(res['bodies'][0]['html'], '')
+        self.assertEqual(res['bodies'][1]['text'], 'see attachment')
+        self.assertEqual(res['attachments'], [{
+            'part': '2',
+            'filename': 'data.bin',
+            'content_type': 'application/octet-stream',
+            'size': 7,
+        }])
+        part = res['bodies'][2]
+        self.assertEqual(
+            b''.join(mockmail._iterDecodedPayload(part['payload'], part['transfer_encoding'], chunkSize=3)),
+            b'\x00\x01\x02\x03\x04\x05\x06')
+
+    def test_textAttachment(self):
+        data = '''Subject: report
+Content-Type: multipart/mixed; boundary="XXX"
+
+--XXX
+Content-Type: text/plain
+
+see attachments
+--XXX
+Content-Type: text/csv
+Content-Disposition: attachment; filename="=?utf-8?b?w7xiZXIuY3N2?="
+
+a,b
+--XXX
+Content-Type: text/plain; name="notes.txt"
+
+notes
+--XXX
+Content-Type: text/plain
+Content-Disposition: inline; filename="inline.txt"
+
+inline text
+--XXX--
+'''
+        res = mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['to@phihag.de'], data)
+        self.assertEqual(
+            [(a['part'], a['filename'], a['content_type']) for a in res['attachments']],
+            [('2', '\xfcber.csv', 'text/csv'), ('3', 'notes.txt', 'text/plain')])
+        self.assertEqual(res['bodies'][2]['html'], '[attachment: \xfcber.csv]')
+        self.assertEqual(res['bodies'][4]['text'], 'inline text')
+
+    def test_malformedBase64(self):
+        data = '''Subject: broken
+Content-Type: multipart/mixed; boundary="XXX"
+
+--XXX
+Content-Type: text/plain
+Content-Transfer-Encoding: base64
+
+A=AA
+--XXX
+Content-Type: application/octet-stream
+Content-Transfer-Encoding: base64
+
+A=AA
+--XXX--
+'''
+        res = mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['to@phihag.de'], data)
+        self.assertTrue(res['bodies'][1]['text'] in ('\x00\x00', 'A=AA'))  # Python 2.x falls back to the undecoded text
+        part = res['bodies'][2]
+        decoded = b''.join(mockmail._iterDecodedPayload(part['payload'], part['transfer_encoding']))
+        self.assertEqual(part['size'], len(decoded))
+        self.assertEqual(len(res['attachments']), 1)
+
+    def test_iterDecodedPayload(self):
+        def decode(payload, cte):
+            return b''.join(mockmail._iterDecodedPayload(payload, cte, chunkSize=5))
+
+        self.assertEqual(decode('w5xtbMOk\ndXRlIDI=\n', 'base64'), b'\xc3\x9cml\xc3\xa4ute 2')
+        self.assertEqual(decode('a=3Db=\nc\n', 'quoted-printable'), b'a=bc\n')
+        self.assertEqual(decode('\xfcber', None), b'\xc3\xbcber')
+
+    def test_sliceChunks(self):
+        chunks = [b'abc', b'def', b'ghi']
+        self.assertEqual(b''.join(mockmail._sliceChunks(iter(chunks), 0, 9)), b'abcdefghi')
+        self.assertEqual(b''.join(mockmail._sliceChunks(iter(chunks), 2, 7)), b'cdefg')
+        self.assertEqual(b''.join(mockmail._sliceChunks(iter(chunks), 3, 6)), b'def')
+
+    def test_parseRange(self):
+        self.assertEqual(mockmail._parseRange(None, 10), None)
+        self.assertEqual(mockmail._parseRange('bytes=2-4', 10), (2, 5))
+        self.assertEqual(mockmail._parseRange('bytes=2-', 10), (2, 10))
+        self.assertEqual(mockmail._parseRange('bytes=2-100', 10), (2, 10))
+        self.assertEqual(mockmail._parseRange('bytes=-3', 10), (7, 10))
+        self.assertEqual(mockmail._parseRange('bytes=0-1,5-6', 10), None)
+        self.assertRaises(ValueError, mockmail._parseRange, 'bytes=10-', 10)
+        self.assertEqual(mockmail._parseRange('bytes=5-4', 10), None)
+        self.assertEqual(mockmail._parseRange('bytes=12-11', 10), None)
+        self.assertRaises(ValueError, mockmail._parseRange, 'bytes=10-12', 10)
+        self.assertRaises(ValueError, mockmail._parseRange, 'bytes=-0', 10)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+try:
+    from . import tutils
+except (ImportError, ValueError):  # direct exection
+    import tutils  # NOQA
+
+import mockmail
+
+import unittest
+
+
+def _mail(rcpt, helo=None, body='x'):
+    data = 'Subject: test\n\n' + body
+    return mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', [rcpt], data, helo)
+
+
+class MailStoreTestCase(unittest.TestCase):
+    def test_single(self):
+        ms = mockmail.MailStore()
+        ms.add(_mail('a@example.com'))
+        ms.add(_mail('b@example.org'))
+        self.assertEqual([mb.name for mb in ms.mailboxes], ['default'])
+        self.assertEqual([m['id'] for m in ms.mails], ['0', '1'])
+        self.assertEqual(ms.getById('1')['simple_to'], 'b@example.org')
+        self.assertRaises(KeyError, ms.getById, '2')
+        self.assertRaises(KeyError, ms.getById, 'x')
+
+    def test_tenantName(self):
+        self.assertEqual(mockmail._tenantName('domain', _mail('a@Example.COM')), 'example.com')
+        self.assertEqual(mockmail._tenantName('tag', _mail('ci+job42@example.com')), 'job42')
+        self.assertEqual(mockmail._tenantName('tag', _mail('ci@example.com')), 'default')
+        self.assertEqual(mockmail._tenantName('helo', _mail('a@example.com', helo='Builder1')), 'builder1')
+        self.assertEqual(mockmail._tenantName('helo', _mail('a@example.com')), 'default')
+        self.assertRaises(ValueError, mockmail.MailStore, 'invalid')
+
+    def test_partitioned(self):
+        ms = mockmail.MailStore('domain', max_mails=2, tenant_limits={'quiet.org': {'max_mails': 1}})
+        ms.add(_mail('a@quiet.org'))
+        for i in range(5):
+            ms.add(_mail('a@noisy.com'))
+        ms.add(_mail('b@quiet.org'))
+
+        self.assertEqual([mb.name for mb in ms.mailboxes], ['noisy.com', 'quiet.org'])
+        self.assertEqual([m['id'] for m in ms.getMailbox('noisy.com').mails], ['4', '5'])
+        self.assertEqual([m['id'] for m in ms.getMailbox('quiet.org').mails], ['6'])
+        self.assertEqual(ms.getById('6')['mailbox'], 'quiet.org')
+        self.assertRaises(KeyError, ms.getById, '0')
+        self.assertRaises(KeyError, ms.getMailbox, 'example.com')
+
+    def test_max_bytes(self):
+        ms = mockmail.MailStore(max_bytes=100)
+        for i in range(10):
+            ms.add(_mail('a@example.com', body='x' * 20))
+        mb = ms.getMailbox('default')
+        self.assertEqual(len(mb), 2)
+        self.assertTrue(mb.size <= 100)
+
+        ms.delete(lambda m: m['id'] != '9')
+        self.assertEqual([m['id'] for m in ms.mails], ['8'])
+        self.assertEqual(mb.size, ms.mails[0]['size'])
+
+    def test_listing(self):
+        mb = mockmail.Mailbox('default', max_mails=5)
+        for i in range(8):
+            mail = _mail('a@example.com')
+            mail['id'] = mockmail.compat_str(i)
+            mb.add(mail)
+        self.assertEqual([m['id'] for m in mb.mails], ['3', '4', '5', '6', '7'])
+
+        def listing(**kwargs):
+            first, last, mails = mb.listing(**kwargs)
+            return first, last, [m['seq'] for m in mails]
+
+        self.assertEqual(listing(), (3, 7, [7, 6, 5, 4, 3]))
+        self.assertEqual(listing(count=2), (3, 7, [7, 6]))
+        self.assertEqual(listing(until=5, count=2), (3, 7, [5, 4]))
+        self.assertEqual(listing(until=4), (3, 7, [4, 3]))
+        self.assertEqual(listing(until=100, count=1), (3, 7, [7]))
+        self.assertEqual(listing(after=5), (3, 7, [7, 6]))
+        self.assertEqual(listing(after=7), (3, 7, []))
+        self.assertEqual(listing(until=1), (3, 7, []))
+
+        mb.delete(lambda m: m['seq'] != 5)
+        self.assertEqual(listing(), (3, 7, [7, 6, 4, 3]))
+        mb.delete(lambda m: m['seq'] > 4)
+        self.assertEqual(listing(), (6, 7, [7, 6]))
+
+        self.assertEqual(mockmail.Mailbox('empty').listing(), (0, -1, []))
+
+    def test_compaction(self):
+        mb = mockmail.Mailbox('default', max_mails=10)
+        for i in range(5000):
+            mb.add({'id': mockmail.compat_str(i), 'size': 1})
+        self.assertTrue(len(mb._slots) < 2100)
+        first, last, mails = mb.listing(count=3)
+        self.assertEqual((first, last), (4990, 4999))
+        self.assertEqual([m['id'] for m in mails], ['4999', '4998', '4997'])
+        self.assertEqual(mb.get('4990')['seq'], 4990)
+        self.assertEqual(mb.get('4989'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+try:
+    from . import tutils
+except (ImportError, ValueError):  # direct exection
+    import tutils  # NOQA
+
+import mockmail
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+
+_MAIL = '''To: Someone <to@example.com>
+Cc: other@example.org
+Subject: test
+
+From the start
+>From quoted
+body'''
+
+
+class MboxTestCase(unittest.TestCase):
+    def test_roundtrip(self):
+        ms = mockmail.MailStore()
+        ms.add(mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['to@example.com'], _MAIL))
+        ms.add(mockmail.parseMail(('127.0.0.1', 4242), '', ['to@example.com'], 'Subject: second\n\nx'))
+
+        mbox = b''.join(mockmail._mboxEntry(m) for m in ms.mails)
+        self.assertTrue(mbox.startswith(b'From from@phihag.de '))
+        self.assertTrue(b'\n>From the start\n>>From quoted\n' in mbox)
+        self.assertTrue(b'\n\nFrom MAILER-DAEMON ' in mbox)
+
+        parsed = list(mockmail._iterMbox(io.BytesIO(mbox)))
+        self.assertEqual(parsed, [
+            ('from@phihag.de', _MAIL.encode('utf-8') + b'\n'),
+            ('MAILER-DAEMON', b'Subject: second\n\nx\n'),
+        ])
+
+    def test_import(self):
+        mbox = b''.join(
+            b'From sender@example.com Thu Jan  1 00:00:00 1970\n' +
+            _MAIL.encode('utf-8').replace(b'\nFrom ', b'\n>From ').replace(b'\n>From quoted', b'\n>>From quoted') + b'\n\n'
+            for _ in range(5))
+        ms = mockmail.MailStore('domain')
+        self.assertEqual(mockmail.importMbox(ms, io.BytesIO(mbox), batchSize=2), 5)
+
+        mails = ms.mails
+        self.assertEqual(len(mails), 5)
+        self.assertEqual([m['id'] for m in mails], ['0', '1', '2', '3', '4'])
+        self.assertEqual(mails[0]['rcpttos'], ['to@example.com', 'other@example.org'])
+        self.assertEqual(mails[0]['envelope'], 'MAIL-FROM: sender@example.com\nRCPT-TO: to@example.com\nRCPT-TO: other@example.org')
+        self.assertEqual(mails[0]['mailbox'], 'example.com')
+        self.assertEqual(mails[0]['rawdata'], (_MAIL + '\n').encode('utf-8'))
+
+    def test_headerRecipients(self):
+        mail = mockmail.parseMail(('import', 0), '', None, 'To: a@example.com\nDelivered-To: b@example.com\n\nx')
+        self.assertEqual(mail['rcpttos'], ['b@example.com'])
+        mail = mockmail.parseMail(('import', 0), '', None, 'Subject: nobody\n\nx')
+        self.assertEqual(mail['rcpttos'], [])
+        self.assertEqual(mail['simple_to'], '<nobody>')
+
+    def test_maildir(self):
+        ms = mockmail.MailStore()
+        ms.add(mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['to@example.com'], _MAIL))
+        buf = io.BytesIO()
+        mockmail._writeMaildirTar(buf, ms.mails)
+        buf.seek(0)
+
+        tar = tarfile.open(fileobj=buf, mode='r|')
+        members = {}
+        for info in tar:
+            members[info.name] = tar.extractfile(info).read() if info.isfile() else None
+        tar.close()
+        self.assertEqual(sorted(members), ['cur', 'new', 'new/%d.M0.mockmail' % ms.mails[0]['receivedAt_epoch'], 'tmp'])
+        self.assertEqual(members['new/%d.M0.mockmail' % ms.mails[0]['receivedAt_epoch']], _MAIL.encode('utf-8'))
+
+    def test_extractMaildir(self):
+        ms = mockmail.MailStore()
+        ms.add(mockmail.parseMail(('127.0.0.1', 4242), 'from@phihag.de', ['to@example.com'], _MAIL))
+        buf = io.BytesIO()
+        mockmail._writeMaildirTar(buf, ms.mails)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            target = os.path.join(tmpdir, 'maildir')
+            buf.seek(0)
+            mockmail._extractMaildirTar(buf, target)
+            self.assertEqual(sorted(os.listdir(target)), ['cur', 'new', 'tmp'])
+            self.assertEqual(len(os.listdir(os.path.join(target, 'new'))), 1)
+
+            for name in ('../evil', 'new/../../evil', '/tmp/evil', 'evil', 'new/..'):
+                buf = io.BytesIO()
+                tar = tarfile.open(fileobj=buf, mode='w|')
+                info = tarfile.TarInfo(name)
+                info.size = 1
+                tar.addfile(info, io.BytesIO(b'x'))
+                tar.close()
+                buf.seek(0)
+                self.assertRaises(ValueError, mockmail._extractMaildirTar, buf, target)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['maildir'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -71,6 +71,24 @@ class MustacheTestCase(unittest.TestCase):
             )
         )
 
+    def test_parseTemplate(self):
+        self.assertEqual(mockmail._parseTemplate('a{{b}}c{{{d}}}{{>e}}{{#f}}g{{h}}{{/f}}'), [
+            ['text', 'a'],
+            ['var', 'b'],
+            ['text', 'c'],
+            ['raw', 'd'],
+            ['partial', 'e'],
+            ['section', 'f', [['text', 'g'], ['var', 'h']]],
+        ])
+        self.assertRaises(ValueError, mockmail._parseTemplate, '{{#a}}')
+        self.assertRaises(ValueError, mockmail._parseTemplate, '{{/a}}')
+
+        r = mockmail.MustacheRenderer({'t': mockmail._parseTemplate('<{{x}}>')})
+        self.assertEqual(r.render(mockmail._parseTemplate('{{>t}}{{#l}}{{>t}}{{/l}}'), {
+            'x': 1,
+            'l': [{'x': 2}, {'x': 3}],
+        }), '<1><2><3>')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+try:
+    from . import tutils
+except (ImportError, ValueError):  # direct exection
+    import tutils  # NOQA
+
+import mockmail
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+_RESOURCEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'share', 'mockmail')
+
+
+class ResourcesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.resourcedir = os.path.join(tempfile.mkdtemp(), 'mockmail')
+        shutil.copytree(_RESOURCEDIR, self.resourcedir)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.resourcedir))
+
+    def test_bundle(self):
+        self.assertEqual(mockmail._loadBundle(self.resourcedir), None)
+        templates, static = mockmail._readResources(self.resourcedir)
+
+        mockmail._buildBundle(self.resourcedir)
+        bundle = mockmail._loadBundle(self.resourcedir)
+        self.assertEqual(bundle[0], templates)
+        self.assertEqual(bundle[1], static)
+        for fn, content in static.items():
+            self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(bundle[2][fn])).read(), content)
+        self.assertEqual(mockmail._loadResources(self.resourcedir), bundle)
+
+        # Outdated bundles must be ignored
+        future = time.time() + 10
+        os.utime(os.path.join(self.resourcedir, 'templates', 'mail.mustache'), (future, future))
+        self.assertEqual(mockmail._loadBundle(self.resourcedir), None)
+        self.assertEqual(mockmail._loadResources(self.resourcedir), (templates, static, {}))
+
+    def test_acceptsGzip(self):
+        self.assertTrue(mockmail._acceptsGzip('gzip, deflate'))
+        self.assertTrue(mockmail._acceptsGzip('deflate, GZIP;q=0.5'))
+        self.assertFalse(mockmail._acceptsGzip(None))
+        self.assertFalse(mockmail._acceptsGzip('deflate'))
+        self.assertFalse(mockmail._acceptsGzip('gzip;q=0'))
+        self.assertFalse(mockmail._acceptsGzip('x-gzip'))
+
+
+if __name__ == '__main__':
+    unittest.main()
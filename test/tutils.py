@@ -1,4 +1,4 @@
 import os
 import sys
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bin')))  # NOQA
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))  # NOQA